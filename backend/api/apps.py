@@ -5,3 +5,6 @@ class ApiConfig(AppConfig):
     """Приложение апи"""
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,204 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import views
+from .cache import (conditional_response, ingredients_cache,
+                    patch_version_headers, reference_response,
+                    relation_cache, short_link_cache, tags_cache)
+
+
+def json_response(data):
+    """Ответ в JSON, совпадающий с ответом JSONRenderer DRF."""
+    return HttpResponse(
+        JSONRenderer().render(data), content_type='application/json'
+    )
+
+
+async def authenticate(request):
+    """
+    Асинхронная проверка заголовка Authorization по правилам
+    TokenAuthentication. Возвращает None, если заголовок
+    некорректен: такой ответ формирует DRF.
+    """
+    auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+    keyword = TokenAuthentication.keyword.lower()
+    if not auth or auth[0].lower() != keyword:
+        return AnonymousUser()
+    if len(auth) != 2:
+        return None
+    token = await Token.objects.select_related('user').filter(
+        key=auth[1]
+    ).afirst()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
+
+
+def recipe_view(request, user, action, **kwargs):
+    """
+    Экземпляр RecipeViewSet для асинхронного чтения: набор рецептов,
+    фильтры, версия ответа, пагинация, контекст сериализатора
+    и бюджет запросов те же, что у синхронного представления.
+    """
+    drf_request = Request(request)
+    drf_request.user = user
+    view = views.RecipeViewSet(
+        request=drf_request,
+        args=(),
+        kwargs=kwargs,
+        action=action,
+        detail=action == 'retrieve',
+        basename='recipes',
+        format_kwarg=None,
+    )
+    view.record_view()
+    return view
+
+
+def async_read_view(read, fallback):
+    """
+    Асинхронное представление: GET обслуживает корутина read.
+    Если она вернула None, а также для остальных методов
+    запрос обрабатывает синхронное представление fallback.
+    """
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            response = await read(request, *args, **kwargs)
+            if response is not None:
+                return response
+        return await sync_to_async(fallback)(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    return view
+
+
+def read_reference(reference_cache):
+    """Чтение справочника из кэша; промах обслуживает DRF."""
+    async def read(request, *args, **kwargs):
+        if await authenticate(request) is None:
+            return None
+        entry = await reference_cache.aget(request.get_full_path())
+        if entry is None:
+            return None
+        return reference_response(request, entry, json_response)
+
+    return read
+
+
+async def read_recipe_list(request):
+    """Список рецептов с фильтрами и флагами пользователя."""
+    user = await authenticate(request)
+    if user is None:
+        return None
+    view = recipe_view(request, user, 'list')
+    try:
+        # Поиск без PostgreSQL обращается к индексу в памяти,
+        # который загружается из базы синхронно.
+        queryset = await sync_to_async(view.filter_queryset)(
+            view.get_queryset()
+        )
+    except ValidationError:
+        return None
+    version = await sync_to_async(view.get_response_version)(queryset)
+    response = conditional_response(request, version)
+    if response is None:
+        paginator = view.paginator
+        page = await paginator.apaginate_queryset(queryset, request)
+        if page is None:
+            return None
+        await relation_cache.aprefetch(user)
+        serializer = view.get_serializer(page, many=True)
+        # Промахи кэша фрагментов догружаются из базы синхронно.
+        data = await sync_to_async(lambda: serializer.data)()
+        response = json_response(paginator.get_async_paginated_data(data))
+    view.check_query_budget()
+    return patch_version_headers(request, response, version)
+
+
+async def read_recipe_detail(request, pk):
+    """Рецепт с флагами пользователя."""
+    if request.GET:
+        return None
+    user = await authenticate(request)
+    if user is None:
+        return None
+    view = recipe_view(request, user, 'retrieve', pk=pk)
+    try:
+        version = await sync_to_async(view.get_response_version)(
+            view.get_version_queryset()
+        )
+    except ValueError:
+        return None
+    response = conditional_response(request, version)
+    if response is None:
+        recipe = await view.get_queryset().filter(pk=pk).afirst()
+        if recipe is None:
+            return None
+        await relation_cache.aprefetch(user)
+        response = json_response(view.get_serializer(recipe).data)
+    view.check_query_budget()
+    return patch_version_headers(request, response, version)
+
+
+async def read_short_link(request, short_link):
+    """Перенаправление по короткой ссылке."""
+    pk = await short_link_cache.aresolve(short_link)
+    if pk is None:
+        raise Http404
+    return HttpResponseRedirect(f'/recipes/{pk}/')
+
+
+tag_list = async_read_view(
+    read_reference(tags_cache),
+    views.TagViewSet.as_view(
+        {'get': 'list'}, basename='tags', detail=False
+    ),
+)
+tag_detail = async_read_view(
+    read_reference(tags_cache),
+    views.TagViewSet.as_view(
+        {'get': 'retrieve'}, basename='tags', detail=True
+    ),
+)
+ingredient_list = async_read_view(
+    read_reference(ingredients_cache),
+    views.IngredientViewSet.as_view(
+        {'get': 'list'}, basename='ingredients', detail=False
+    ),
+)
+ingredient_detail = async_read_view(
+    read_reference(ingredients_cache),
+    views.IngredientViewSet.as_view(
+        {'get': 'retrieve'}, basename='ingredients', detail=True
+    ),
+)
+recipe_list = async_read_view(
+    read_recipe_list,
+    views.RecipeViewSet.as_view(
+        {'get': 'list', 'post': 'create'},
+        basename='recipes',
+        detail=False,
+    ),
+)
+recipe_detail = async_read_view(
+    read_recipe_detail,
+    views.RecipeViewSet.as_view(
+        {
+            'get': 'retrieve',
+            'put': 'update',
+            'patch': 'partial_update',
+            'delete': 'destroy',
+        },
+        basename='recipes',
+        detail=True,
+    ),
+)
+redirect_short_link = async_read_view(
+    read_short_link, views.redirect_short_link
+)
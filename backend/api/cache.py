@@ -0,0 +1,526 @@
+import hashlib
+import json
+import time
+from array import array
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max, Value
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers, quote_etag)
+from django.utils.http import http_date
+from recipes.models import Cart, Favorite, Recipe
+from rest_framework.response import Response
+from users.models import Subscription
+
+from .constants import ALLOWED_CHARS, MAX_LENGTH_SHORT_LINK
+
+
+class ReferenceCache:
+    """
+    Двухуровневый кэш справочных данных: локальный LRU процесса
+    и общий бэкенд Django. Записи привязаны к версии справочника,
+    которая меняется при любом изменении данных.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._local = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[settings.REFERENCE_CACHE_ALIAS]
+
+    @property
+    def version_key(self):
+        return f'reference:{self.name}:version'
+
+    def get_version(self):
+        """Возвращает текущую версию (время последнего изменения)."""
+        version = self.shared.get(self.version_key)
+        if version is None:
+            self.shared.add(self.version_key, time.time(), None)
+            version = self.shared.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        """Объявляет все закэшированные записи устаревшими."""
+        self.shared.set(self.version_key, time.time(), None)
+        self._local.clear()
+
+    def get_or_set(self, key, factory):
+        """
+        Возвращает запись (данные, ETag, время изменения) по ключу,
+        вычисляя данные через factory при промахе обоих уровней.
+        """
+        version = self.get_version()
+        entry = self._get_local(version, key)
+        if entry is not None:
+            return entry
+        shared_key = self._shared_key(version, key)
+        entry = self.shared.get(shared_key)
+        if entry is None:
+            data = factory()
+            content = json.dumps(
+                data, sort_keys=True, ensure_ascii=False, default=str
+            )
+            entry = {
+                'data': data,
+                'etag': quote_etag(
+                    hashlib.md5(content.encode()).hexdigest()
+                ),
+                'last_modified': int(version),
+            }
+            self.shared.set(
+                shared_key, entry, settings.REFERENCE_CACHE_TIMEOUT
+            )
+        self._set_local(version, key, entry)
+        return entry
+
+    async def aget(self, key):
+        """
+        Асинхронно возвращает запись по ключу или None при промахе.
+        Данные не вычисляет: это делает синхронный get_or_set.
+        """
+        version = await self.shared.aget(self.version_key)
+        if version is None:
+            return None
+        entry = self._get_local(version, key)
+        if entry is None:
+            entry = await self.shared.aget(self._shared_key(version, key))
+            if entry is not None:
+                self._set_local(version, key, entry)
+        return entry
+
+    def _shared_key(self, version, key):
+        return f'reference:{self.name}:{version}:{key}'
+
+    def _get_local(self, version, key):
+        entry = self._local.get((version, key))
+        if entry is not None:
+            self._local.move_to_end((version, key))
+        return entry
+
+    def _set_local(self, version, key, entry):
+        self._local[(version, key)] = entry
+        while len(self._local) > settings.REFERENCE_CACHE_LOCAL_SIZE:
+            self._local.popitem(last=False)
+
+
+tags_cache = ReferenceCache('tags')
+ingredients_cache = ReferenceCache('ingredients')
+# Только версия: по ее смене перестраивается индекс поиска рецептов.
+recipes_cache = ReferenceCache('recipes')
+
+
+def reference_response(request, entry, response_class):
+    """
+    Ответ с записью справочника и заголовками ETag и Last-Modified
+    или 304, если у клиента актуальная версия.
+    """
+    response = get_conditional_response(
+        request,
+        etag=entry['etag'],
+        last_modified=entry['last_modified'],
+    )
+    if response is None:
+        response = response_class(entry['data'])
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    return response
+
+
+class ReferenceCacheMixin:
+    """
+    Отдает list и retrieve из кэша справочника с заголовками
+    ETag и Last-Modified и отвечает 304 на условные запросы.
+    """
+    reference_cache = None
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        entry = self.reference_cache.get_or_set(
+            request.get_full_path(),
+            lambda: handler(request, *args, **kwargs).data
+        )
+        return reference_response(request, entry, Response)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().retrieve, *args, **kwargs
+        )
+
+
+class ShortLinkCache:
+    """
+    Кэш соответствия короткой ссылки и id рецепта:
+    локальный LRU процесса и общий бэкенд Django.
+    Соответствие не меняется, пока рецепт существует,
+    поэтому сбрасывается только при удалении рецепта.
+    """
+
+    def __init__(self):
+        self._local = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[settings.REFERENCE_CACHE_ALIAS]
+
+    @staticmethod
+    def is_valid(short_link):
+        return len(short_link) <= MAX_LENGTH_SHORT_LINK and all(
+            char in ALLOWED_CHARS for char in short_link
+        )
+
+    def resolve(self, short_link):
+        """Возвращает id рецепта по короткой ссылке или None."""
+        if not self.is_valid(short_link):
+            return None
+        pk = self._local.get(short_link)
+        if pk is not None:
+            self._local.move_to_end(short_link)
+            return pk
+        key = f'short_link:{short_link}'
+        pk = self.shared.get(key)
+        if pk is None:
+            pk = Recipe.objects.filter(
+                short_link=short_link
+            ).values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            self.shared.set(key, pk, settings.SHORT_LINK_CACHE_TIMEOUT)
+        self._remember(short_link, pk)
+        return pk
+
+    async def aresolve(self, short_link):
+        """Асинхронный вариант resolve."""
+        if not self.is_valid(short_link):
+            return None
+        pk = self._local.get(short_link)
+        if pk is not None:
+            self._local.move_to_end(short_link)
+            return pk
+        key = f'short_link:{short_link}'
+        pk = await self.shared.aget(key)
+        if pk is None:
+            pk = await Recipe.objects.filter(
+                short_link=short_link
+            ).values_list('pk', flat=True).afirst()
+            if pk is None:
+                return None
+            await self.shared.aset(
+                key, pk, settings.SHORT_LINK_CACHE_TIMEOUT
+            )
+        self._remember(short_link, pk)
+        return pk
+
+    def forget(self, short_link):
+        """Удаляет короткую ссылку из обоих уровней кэша."""
+        self._local.pop(short_link, None)
+        self.shared.delete(f'short_link:{short_link}')
+
+    def _remember(self, short_link, pk):
+        self._local[short_link] = pk
+        while len(self._local) > settings.SHORT_LINK_CACHE_LOCAL_SIZE:
+            self._local.popitem(last=False)
+
+
+short_link_cache = ShortLinkCache()
+
+
+class UserRelationCache:
+    """
+    Множества id для флагов is_favorited, is_in_shopping_cart
+    и is_subscribed: рецепты в избранном и корзине пользователя
+    и авторы, на которых он подписан. В общем кэше множества
+    хранятся отсортированными array('q'), на время запроса —
+    как frozenset в объекте пользователя. Данные привязаны
+    к версии, которую меняет invalidate, поэтому загрузка,
+    начатая до изменения, не перезапишет свежую запись.
+    """
+    RELATIONS = (
+        ('favorites', Favorite, 'user_id', 'recipe_id'),
+        ('cart', Cart, 'user_id', 'recipe_id'),
+        ('subscriptions', Subscription, 'subscribers_id', 'author_id'),
+    )
+
+    @property
+    def shared(self):
+        return caches[settings.REFERENCE_CACHE_ALIAS]
+
+    @staticmethod
+    def version_key(user_id, relation):
+        return f'relations:{relation}:{user_id}'
+
+    def get(self, user, relation):
+        """
+        Множество id связи пользователя, для анонима пустое.
+        При первом обращении за запрос загружаются все связи.
+        """
+        if not user.is_authenticated:
+            return frozenset()
+        loaded = user.__dict__.get('relation_ids')
+        if loaded is None:
+            loaded = user.__dict__['relation_ids'] = self.load(user.pk)
+        return loaded[relation]
+
+    async def aprefetch(self, user):
+        """Загружает связи пользователя до синхронной сериализации."""
+        if user.is_authenticated and 'relation_ids' not in user.__dict__:
+            user.__dict__['relation_ids'] = await sync_to_async(
+                self.load
+            )(user.pk)
+
+    def versions(self, user_id):
+        """
+        Текущие версии связей пользователя {связь: версия}.
+        Отсутствующие версии создаются.
+        """
+        version_keys = {relation[0]: self.version_key(user_id, relation[0])
+                        for relation in self.RELATIONS}
+        cached = self.shared.get_many(version_keys.values())
+        versions = {}
+        for name, key in version_keys.items():
+            version = cached.get(key)
+            if version is None:
+                self.shared.add(
+                    key, time.time(), settings.RELATION_CACHE_TIMEOUT
+                )
+                version = self.shared.get(key)
+            versions[name] = version
+        return versions
+
+    def load(self, user_id):
+        """Множества из общего кэша, промахи — одним запросом к базе."""
+        names = [relation[0] for relation in self.RELATIONS]
+        data_keys = {
+            name: f'{self.version_key(user_id, name)}:{version}'
+            for name, version in self.versions(user_id).items()
+        }
+        cached = self.shared.get_many(data_keys.values())
+        result = {name: cached[data_keys[name]] for name in names
+                  if data_keys[name] in cached}
+        missing = [name for name in names if name not in result]
+        if missing:
+            fetched = self.fetch(user_id, missing)
+            self.shared.set_many(
+                {data_keys[name]: fetched[name] for name in missing},
+                settings.RELATION_CACHE_TIMEOUT,
+            )
+            result.update(fetched)
+        return {name: frozenset(ids) for name, ids in result.items()}
+
+    def fetch(self, user_id, names):
+        """Id нескольких связей одним запросом UNION ALL."""
+        queries = [
+            model.objects.filter(**{owner: user_id}).order_by().annotate(
+                relation=Value(index)
+            ).values_list(target, 'relation')
+            for index, (name, model, owner, target) in enumerate(
+                self.RELATIONS
+            )
+            if name in names
+        ]
+        ids = {name: [] for name in names}
+        for pk, index in queries[0].union(*queries[1:], all=True):
+            ids[self.RELATIONS[index][0]].append(pk)
+        return {name: array('q', sorted(values))
+                for name, values in ids.items()}
+
+    def invalidate(self, model, user_id):
+        """Объявляет устаревшим множество связи model пользователя."""
+        for name, relation_model, _, _ in self.RELATIONS:
+            if relation_model is model:
+                self.shared.set(
+                    self.version_key(user_id, name), time.time(),
+                    settings.RELATION_CACHE_TIMEOUT,
+                )
+
+    def owner_id(self, instance):
+        """Id пользователя, которому принадлежит строка связи."""
+        for _, model, owner, _ in self.RELATIONS:
+            if isinstance(instance, model):
+                return getattr(instance, owner)
+
+
+relation_cache = UserRelationCache()
+
+
+class RecipeFragmentCache:
+    """
+    Общая для всех пользователей часть представления рецептов.
+    Ключ фрагмента включает версии рецепта и автора (updated_at),
+    справочников тегов и ингредиентов, размер изображения и адрес
+    сайта из абсолютных URL. Флаги пользователя в кэш не попадают:
+    их накладывает сериализатор списка.
+    """
+
+    @property
+    def shared(self):
+        return caches[settings.REFERENCE_CACHE_ALIAS]
+
+    @staticmethod
+    def key(recipe, references, context):
+        request = context.get('request')
+        parts = (
+            recipe.updated_at.timestamp(),
+            recipe.author.updated_at.timestamp(),
+            *references,
+            context.get('image_size', 'large'),
+            request.build_absolute_uri('/') if request else '',
+        )
+        digest = hashlib.md5(repr(parts).encode()).hexdigest()
+        return f'recipe_fragment:{recipe.pk}:{digest}'
+
+    def get_many(self, recipes, serializer):
+        """
+        Фрагменты рецептов в порядке recipes. Промахи загружаются
+        одним запросом с предзагрузкой и сериализуются serializer;
+        удаленные за это время рецепты пропускаются.
+        """
+        context = serializer.context
+        references = (tags_cache.get_version(),
+                      ingredients_cache.get_version())
+        keys = {recipe.pk: self.key(recipe, references, context)
+                for recipe in recipes}
+        fragments = self.shared.get_many(keys.values())
+        missing = [pk for pk, key in keys.items() if key not in fragments]
+        if missing:
+            fresh = {}
+            for recipe in Recipe.objects.with_related().filter(
+                pk__in=missing
+            ):
+                keys[recipe.pk] = self.key(recipe, references, context)
+                fresh[keys[recipe.pk]] = serializer.to_representation(recipe)
+            self.shared.set_many(
+                fresh, settings.RECIPE_FRAGMENT_CACHE_TIMEOUT
+            )
+            fragments.update(fresh)
+        return [fragments[keys[recipe.pk]] for recipe in recipes
+                if keys[recipe.pk] in fragments]
+
+
+recipe_fragments = RecipeFragmentCache()
+
+
+def response_version(user, queryset, fields, references=()):
+    """
+    Версия ответа по набору объектов: их число и последние
+    updated_at полей fields вместе с версиями справочников
+    references. Для пользователя в версию входят и его связи,
+    от которых зависят флаги is_favorited и is_subscribed.
+    Возвращает (ETag, Last-Modified) или None для пустого набора.
+    """
+    stamp = queryset.order_by().aggregate(
+        count=Count('pk'),
+        **{f'last_{index}': Max(field)
+           for index, field in enumerate(fields)},
+    )
+    if not stamp['count']:
+        return None
+    changed = [
+        stamp[f'last_{index}'].timestamp()
+        for index in range(len(fields))
+        if stamp[f'last_{index}'] is not None
+    ] + [reference.get_version() for reference in references]
+    parts = [stamp['count'], *changed]
+    if user.is_authenticated:
+        parts += [user.pk, *relation_cache.versions(user.pk).values()]
+    return (
+        quote_etag(hashlib.md5(repr(parts).encode()).hexdigest()),
+        int(max(changed)),
+    )
+
+
+def conditional_response(request, version):
+    """Ответ 304 или 412 по заголовкам запроса либо None."""
+    if version is None:
+        return None
+    etag, last_modified = version
+    return get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+
+
+def patch_version_headers(request, response, version):
+    """
+    Заголовки ETag, Last-Modified и Cache-Control. Ответы
+    анонимам одинаковы для всех и кэшируются nginx, ответы
+    с флагами пользователя — только в его браузере.
+    """
+    patch_vary_headers(response, ('Authorization',))
+    if version is None or response.status_code not in (200, 304):
+        return response
+    etag, last_modified = version
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(
+            response, public=True, max_age=settings.PUBLIC_CACHE_MAX_AGE
+        )
+    return response
+
+
+class VersionedResponseMixin:
+    """
+    Условные GET для list и retrieve: ETag и Last-Modified
+    по версии набора из response_version и 304, если у клиента
+    актуальная версия. Тело ответа тогда не строится.
+    """
+    version_fields = ('updated_at',)
+    version_references = ()
+
+    def get_version_queryset(self):
+        """Объект, от которого зависит ответ retrieve."""
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return self.get_queryset().filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+
+    def get_response_version(self, queryset):
+        """Версия ответа по набору queryset для текущего пользователя."""
+        return response_version(
+            self.request.user,
+            queryset,
+            self.version_fields,
+            self.version_references,
+        )
+
+    def versioned_response(self, get_queryset, build):
+        request = self.request
+        try:
+            version = self.get_response_version(get_queryset())
+        except ValueError:
+            # Некорректный id: ответ 404 сформирует build.
+            version = None
+        response = conditional_response(request, version)
+        if response is None:
+            response = build()
+        return patch_version_headers(request, response, version)
+
+    def list(self, request, *args, **kwargs):
+        """Фильтры применяются один раз для версии и для ответа."""
+        queryset = self.filter_queryset(self.get_queryset())
+
+        def build():
+            page = self.paginate_queryset(queryset)
+            if page is None:
+                return Response(self.get_serializer(queryset, many=True).data)
+            return self.get_paginated_response(
+                self.get_serializer(page, many=True).data
+            )
+
+        return self.versioned_response(lambda: queryset, build)
+
+    def retrieve(self, request, *args, **kwargs):
+        retrieve = super().retrieve
+        return self.versioned_response(
+            self.get_version_queryset,
+            lambda: retrieve(request, *args, **kwargs),
+        )
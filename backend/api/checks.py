@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+from .constants import PROCESS_LOCAL_CACHE_BACKENDS
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Версии справочников, рецептов и связей пользователей меняют
+    все процессы сервера и команды manage.py. В кэше памяти
+    процесса изменения из других процессов не видны, и ответы
+    с устаревшим ETag отдаются до истечения таймаута.
+    """
+    backend = settings.CACHES[settings.REFERENCE_CACHE_ALIAS]['BACKEND']
+    if backend not in PROCESS_LOCAL_CACHE_BACKENDS:
+        return []
+    return [Error(
+        f'Кэш {settings.REFERENCE_CACHE_ALIAS} ({backend}) '
+        'не общий для процессов.',
+        hint='Укажите CACHE_LOCATION сервера Redis или другой '
+             'общий бэкенд в CACHE_BACKEND.',
+        id='api.E001',
+    )]
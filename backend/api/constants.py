@@ -10,3 +10,35 @@ MIN_COOKING_TIME = 1
 MIN_INGREDIENT_AMOUNT = 1
 MAX_LENGTH_SHORT_LINK = 12
 PAGINATION_PAGE_COUNT = 6
+SHOPPING_LIST_CHUNK_SIZE = 2000
+SHOPPING_LIST_FILENAME = 'shopping_list'
+SHOPPING_LIST_TITLE = 'Список покупок'
+SHORT_LINK_FEISTEL_ROUNDS = 4
+SHORT_LINK_ATTEMPTS = 5
+CURSOR_ORDERING = ('-created_at', '-id')
+IMAGE_SIZES = {'small': 160, 'medium': 480, 'large': 1200}
+BASE64_DECODE_CHUNK_SIZE = 64 * 1024
+IMAGE_HEADER_SIZE = 8 * 1024
+METRICS_DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+# Бэкенды кэша без общего для процессов хранилища.
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+MAX_BULK_RECIPES = 100
+MAX_COOKABLE_INGREDIENTS = 200
+MAX_COOKABLE_MISSING = 5
+# Поля, по последним изменениям которых строится версия ответа с рецептами.
+RECIPE_VERSION_FIELDS = ('updated_at', 'author__updated_at')
+RECIPE_SEARCH_CONFIG = 'russian'
+# Веса совпадений в индексе поиска рецептов в памяти повторяют
+# веса A, B и C функции ts_rank в PostgreSQL.
+RECIPE_SEARCH_WEIGHTS = {'name': 1.0, 'ingredients': 0.4, 'text': 0.2}
+RUSSIAN_WORD_ENDINGS = (
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую',
+    'юю', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ия', 'ых',
+    'их', 'ым', 'им', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь',
+)
@@ -0,0 +1,78 @@
+import base64
+import binascii
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.fields import ImageField
+
+from .constants import BASE64_DECODE_CHUNK_SIZE, IMAGE_HEADER_SIZE
+
+
+class DecodedImageFile(TemporaryUploadedFile):
+    """
+    Временный файл декодированного изображения. Закрывается
+    при сборке мусора: после сохранения хранилище перемещает
+    файл, и удалять уже нечего.
+    """
+
+    def __del__(self):
+        self.close()
+
+
+class StreamingBase64ImageField(Base64ImageField):
+    """
+    Поле изображения, которое декодирует base64 частями сразу
+    во временный файл на диске, не создавая копий всего файла
+    в памяти. Также принимает файлы из multipart-запросов.
+    """
+
+    def decode_to_file(self, data):
+        """Декодирует base64-строку частями во временный файл."""
+        start = data.find(';base64,')
+        offset = 0 if start == -1 else start + len(';base64,')
+        upload = DecodedImageFile(
+            name=str(uuid.uuid4()),
+            content_type=None,
+            size=0,
+            charset=None,
+        )
+        tail = ''
+        try:
+            for position in range(
+                offset, len(data), BASE64_DECODE_CHUNK_SIZE
+            ):
+                chunk = tail + ''.join(
+                    data[position:position + BASE64_DECODE_CHUNK_SIZE].split()
+                )
+                cut = len(chunk) - len(chunk) % 4
+                upload.write(base64.b64decode(chunk[:cut], validate=True))
+                tail = chunk[cut:]
+        except binascii.Error:
+            upload.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        if tail:
+            upload.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if isinstance(data, UploadedFile):
+            return ImageField.to_internal_value(self, data)
+        if not isinstance(data, str):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+
+        upload = self.decode_to_file(data)
+        header = upload.read(IMAGE_HEADER_SIZE)
+        upload.seek(0)
+        extension = self.get_file_extension(upload.name, header)
+        if extension not in self.ALLOWED_TYPES:
+            upload.close()
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        upload.name = f'{upload.name}.{extension}'
+        return ImageField.to_internal_value(self, upload)
@@ -1,23 +1,33 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 import django_filters
 
-from recipes.models import Recipe, Tag
+from recipes.models import Cart, Favorite, Recipe, RecipeTag, Tag
 from rest_framework import filters as drf_filters
+from rest_framework.exceptions import ValidationError
+
+from .pagination import FeedPagination
+from .search import ingredient_index, search_ingredients, search_recipes
 
 
 class RecipeFilter(filters.FilterSet):
     """Фильтр рецептов с возможностью фильтрации по
-    наличию в списке покупок, избранном, по тегам и автору.
+    наличию в списке покупок, избранном, по тегам и автору
+    и полнотекстовым поиском search.
+    Связанные таблицы проверяются подзапросами EXISTS,
+    поэтому выборка не размножает строки и не требует DISTINCT.
     """
 
     is_in_shopping_cart = django_filters.CharFilter(
         method="filter_is_in_shopping_cart"
     )
     is_favorited = django_filters.CharFilter(method="filter_is_favorited")
+    search = django_filters.CharFilter(method="filter_search")
     tags = filters.ModelMultipleChoiceFilter(
         field_name="tags__slug",
         to_field_name="slug",
         queryset=Tag.objects.all(),
+        method="filter_tags",
     )
 
     class Meta:
@@ -27,21 +37,62 @@ class RecipeFilter(filters.FilterSet):
             'author': ['exact'],
         }
 
+    def filter_tags(self, queryset, name, value):
+        """Фильтр по любому из выбранных тегов"""
+        if not value:
+            return queryset
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipe=OuterRef('pk'),
+            tag__in=[tag.id for tag in value],
+        )))
+
     def filter_is_in_shopping_cart(self, queryset, name, value):
         """Фильтр по факту наличия в корзине"""
         author = self.request.user
         if value and author.is_authenticated:
-            return queryset.filter(in_carts__user=author)
+            return queryset.filter(Exists(Cart.objects.filter(
+                user=author, recipe=OuterRef('pk')
+            )))
         return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         """Фильтр по факту наличия в избранном"""
         author = self.request.user
         if value and author.is_authenticated:
-            return queryset.filter(in_favorites__user=author)
+            return queryset.filter(Exists(Favorite.objects.filter(
+                user=author, recipe=OuterRef('pk')
+            )))
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        """
+        Поиск по названию, ингредиентам и тексту с ранжированием.
+        Курсор пагинации сортирует по дате и отменил бы сортировку
+        по рангу, поэтому вместе с поиском он не принимается.
+        """
+        value = value.strip()
+        if not value:
+            return queryset
+        if FeedPagination.cursor_query_param in self.request.query_params:
+            raise ValidationError({'search': [
+                'Результаты поиска листаются по номеру страницы, '
+                'параметр cursor не поддерживается.'
+            ]})
+        return search_recipes(queryset, value)
+
 
 class IngredientSearchFilter(drf_filters.SearchFilter):
-    """Фильтр ингредиентов по названию"""
+    """Фильтр ингредиентов по названию: сначала совпадения
+    по началу названия, затем по вхождению подстроки.
+    Список отдается из индекса в памяти, если он отвечает
+    на такой запрос.
+    """
     search_param = 'name'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        if view.action == 'list' and ingredient_index.serves(term):
+            return ingredient_index.search(term)
+        return search_ingredients(queryset, term)
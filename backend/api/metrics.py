@@ -0,0 +1,271 @@
+import logging
+import os
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from threading import Lock
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .constants import METRICS_DURATION_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+_current_stats = ContextVar('request_stats', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """Действие выполнило больше запросов, чем разрешено."""
+
+
+class RequestStats:
+    """Затраты одного запроса."""
+    __slots__ = ('view', 'queries', 'db_time', 'serialization_time')
+
+    def __init__(self):
+        self.view = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """Обертка выполнения SQL: считает запросы и время в базе."""
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def install_query_recorder(connection):
+    """Подключает record_query к соединению с базой один раз."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsRegistry:
+    """
+    Накопленные метрики процесса в разрезе представлений.
+    Каждый воркер хранит свои значения, метка pid
+    позволяет суммировать их в Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._requests = defaultdict(int)
+        self._totals = defaultdict(float)
+        self._buckets = defaultdict(
+            lambda: [0] * len(METRICS_DURATION_BUCKETS)
+        )
+        self._durations = defaultdict(lambda: [0, 0.0])
+
+    def observe(self, stats, method, status, duration, size):
+        view = stats.view
+        with self._lock:
+            self._requests[(view, method, status)] += 1
+            self._totals[('db_queries_total', view)] += stats.queries
+            self._totals[('db_seconds_total', view)] += stats.db_time
+            self._totals[('serialization_seconds_total', view)] += (
+                stats.serialization_time
+            )
+            self._totals[('response_bytes_total', view)] += size
+            buckets = self._buckets[view]
+            for index, bound in enumerate(METRICS_DURATION_BUCKETS):
+                if duration <= bound:
+                    buckets[index] += 1
+            summary = self._durations[view]
+            summary[0] += 1
+            summary[1] += duration
+
+    def budget_exceeded(self, view):
+        with self._lock:
+            self._totals[('query_budget_exceeded_total', view)] += 1
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        pid = os.getpid()
+        lines = []
+        with self._lock:
+            lines.append('# TYPE foodgram_requests_total counter')
+            for (view, method, status), value in self._requests.items():
+                lines.append(
+                    f'foodgram_requests_total{{pid="{pid}",view="{view}",'
+                    f'method="{method}",status="{status}"}} {value}'
+                )
+            totals = defaultdict(list)
+            for (name, view), value in self._totals.items():
+                totals[name].append((view, value))
+            for name, values in sorted(totals.items()):
+                lines.append(f'# TYPE foodgram_{name} counter')
+                lines.extend(
+                    f'foodgram_{name}{{pid="{pid}",view="{view}"}} {value:g}'
+                    for view, value in values
+                )
+            lines.append('# TYPE foodgram_request_seconds histogram')
+            for view, (count, total) in self._durations.items():
+                labels = f'pid="{pid}",view="{view}"'
+                for bound, value in zip(
+                    METRICS_DURATION_BUCKETS, self._buckets[view]
+                ):
+                    lines.append(
+                        f'foodgram_request_seconds_bucket{{{labels},'
+                        f'le="{bound}"}} {value}'
+                    )
+                lines.append(
+                    f'foodgram_request_seconds_bucket{{{labels},'
+                    f'le="+Inf"}} {count}'
+                )
+                lines.append(
+                    f'foodgram_request_seconds_sum{{{labels}}} {total:g}'
+                )
+                lines.append(
+                    f'foodgram_request_seconds_count{{{labels}}} {count}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """
+    Собирает для каждого запроса число SQL-запросов, время в базе,
+    время сериализации, размер и длительность ответа.
+    Работает в синхронном и асинхронном режиме.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        self.observe(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        self.observe(request, response, stats, started)
+        return response
+
+    @staticmethod
+    def observe(request, response, stats, started):
+        if stats.view is None:
+            match = request.resolver_match
+            stats.view = match.view_name if match else 'unmatched'
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(
+            stats,
+            request.method,
+            response.status_code,
+            time.perf_counter() - started,
+            size,
+        )
+
+
+_timed_serializers = {}
+
+
+def timed_serializer(serializer_class):
+    """
+    Подкласс сериализатора, который добавляет время
+    to_representation к затратам запроса. Для many=True
+    замеряется каждый элемент списка.
+    """
+    timed = _timed_serializers.get(serializer_class)
+    if timed is None:
+        def to_representation(self, instance):
+            stats = _current_stats.get()
+            if stats is None:
+                return super(timed, self).to_representation(instance)
+            started = time.perf_counter()
+            try:
+                return super(timed, self).to_representation(instance)
+            finally:
+                stats.serialization_time += time.perf_counter() - started
+
+        timed = type(
+            serializer_class.__name__,
+            (serializer_class,),
+            {
+                '__module__': serializer_class.__module__,
+                'to_representation': to_representation,
+            },
+        )
+        _timed_serializers[serializer_class] = timed
+    return timed
+
+
+class MetricsMixin:
+    """
+    Метрики действий ViewSet: метка «класс.действие», время
+    сериализации и бюджет запросов к базе query_budget
+    вида {действие: максимум запросов}.
+    """
+    query_budget = {}
+
+    def get_serializer(self, *args, **kwargs):
+        serializer_class = timed_serializer(self.get_serializer_class())
+        kwargs.setdefault('context', self.get_serializer_context())
+        return serializer_class(*args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        self.record_view()
+        super().initial(request, *args, **kwargs)
+
+    def record_view(self):
+        """Метка «класс.действие» для метрик текущего запроса."""
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.view = f'{type(self).__name__}.{self.action}'
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        self.check_query_budget()
+        return response
+
+    def check_query_budget(self):
+        """Сообщает о превышении бюджета или прерывает запрос."""
+        stats = _current_stats.get()
+        budget = self.query_budget.get(self.action)
+        if (stats is None or budget is None
+                or settings.QUERY_BUDGET_MODE == 'off'
+                or stats.queries <= budget):
+            return
+        registry.budget_exceeded(stats.view)
+        message = (
+            f'{stats.view}: {stats.queries} запросов к базе '
+            f'при бюджете {budget}'
+        )
+        if settings.QUERY_BUDGET_MODE == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -1,6 +1,45 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from collections import OrderedDict
 
-from .constants import PAGINATION_PAGE_COUNT
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .constants import CURSOR_ORDERING, PAGINATION_PAGE_COUNT
+
+
+def estimate_count(queryset):
+    """
+    Оценка количества строк по плану запроса PostgreSQL.
+    Небольшие выборки и другие СУБД считаются точно.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = plan[0]['Plan']['Plan Rows']
+    if estimate < settings.PAGINATION_EXACT_COUNT_THRESHOLD:
+        return queryset.count()
+    return estimate
+
+
+class ApproximateCountPaginator(Paginator):
+    """Пагинатор с оценочным подсчетом общего количества."""
+
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
 
 
 class CustomPageNumberPagination(PageNumberPagination):
@@ -8,3 +47,100 @@ class CustomPageNumberPagination(PageNumberPagination):
     элементов на странице."""
     page_size = PAGINATION_PAGE_COUNT
     page_size_query_param = "limit"
+
+
+class FeedPagination(CustomPageNumberPagination):
+    """Пагинация лент: по номеру страницы или, при наличии
+    параметра cursor, курсором DRF. Курсор хранит значение первого
+    поля cursor_ordering (created_at у рецептов) и смещение среди
+    строк с тем же значением; остальные поля только упорядочивают
+    такие строки. Это не ключ (created_at, id), но при редких
+    совпадениях created_at смещение остается небольшим.
+    Параметр count=approximate заменяет точный COUNT оценкой.
+    Формат ответа в обоих режимах одинаковый.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        approximate = (
+            request.query_params.get(self.count_query_param) == 'approximate'
+        )
+        if self.cursor_query_param not in request.query_params:
+            if approximate:
+                self.django_paginator_class = ApproximateCountPaginator
+            self.cursor_paginator = None
+            return super().paginate_queryset(queryset, request, view)
+
+        self.cursor_paginator = CursorPagination()
+        self.cursor_paginator.ordering = getattr(
+            view, 'cursor_ordering', CURSOR_ORDERING
+        )
+        self.cursor_paginator.page_size = self.get_page_size(request)
+        self.cursor_paginator.cursor_query_param = self.cursor_query_param
+        self.count = estimate_count(queryset)
+        return self.cursor_paginator.paginate_queryset(
+            queryset, request, view
+        )
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is None:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.cursor_paginator.get_next_link()),
+            ('previous', self.cursor_paginator.get_previous_link()),
+            ('results', data),
+        ]))
+
+    async def apaginate_queryset(self, queryset, request):
+        """
+        Асинхронная постраничная выборка для запроса Django.
+        Возвращает None, если запрос нужно передать синхронной
+        пагинации (курсор, номер last, страница вне диапазона).
+        """
+        if self.cursor_query_param in request.GET:
+            return None
+        try:
+            page_number = int(request.GET.get(self.page_query_param, 1))
+        except ValueError:
+            return None
+        if page_number < 1:
+            return None
+        page_size = self.get_page_size(Request(request))
+        if request.GET.get(self.count_query_param) == 'approximate':
+            count = await sync_to_async(estimate_count)(queryset)
+        else:
+            count = await queryset.acount()
+        offset = (page_number - 1) * page_size
+        if page_number > 1 and offset >= count:
+            return None
+        results = [
+            item async for item in queryset[offset:offset + page_size]
+        ]
+        url = request.build_absolute_uri()
+        self.count = count
+        self.next_link = None
+        if offset + page_size < count:
+            self.next_link = replace_query_param(
+                url, self.page_query_param, page_number + 1
+            )
+        self.previous_link = None
+        if page_number == 2:
+            self.previous_link = remove_query_param(
+                url, self.page_query_param
+            )
+        elif page_number > 2:
+            self.previous_link = replace_query_param(
+                url, self.page_query_param, page_number - 1
+            )
+        return results
+
+    def get_async_paginated_data(self, data):
+        """Тело ответа для страницы из apaginate_queryset."""
+        return OrderedDict([
+            ('count', self.count),
+            ('next', self.next_link),
+            ('previous', self.previous_link),
+            ('results', data),
+        ])
@@ -0,0 +1,22 @@
+import mimetypes
+import uuid
+
+from rest_framework.parsers import FileUploadParser
+
+
+class ImageUploadParser(FileUploadParser):
+    """
+    Прием изображения телом запроса без кодирования.
+    Файл потоково записывается обработчиками загрузки Django
+    и доступен в request.data под ключом file.
+    """
+    media_type = 'image/*'
+
+    def get_filename(self, stream, media_type, parser_context):
+        filename = super().get_filename(stream, media_type, parser_context)
+        if filename:
+            return filename
+        extension = mimetypes.guess_extension(
+            media_type.split(';')[0].strip()
+        ) or ''
+        return f'{uuid.uuid4()}{extension}'
@@ -0,0 +1,198 @@
+import re
+import sys
+from bisect import bisect_left
+from collections import defaultdict
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, Value, When
+from recipes.models import AmountIngredientInRecipe, Ingredient, Recipe
+
+from .cache import ingredients_cache, recipes_cache
+from .constants import (CURSOR_ORDERING, RECIPE_SEARCH_CONFIG,
+                        RECIPE_SEARCH_WEIGHTS, RUSSIAN_WORD_ENDINGS)
+
+WORD_RE = re.compile(r'\w+')
+
+
+def search_ingredients(queryset, term):
+    """
+    Поиск ингредиентов в базе: сначала совпадения по началу
+    названия, затем по вхождению подстроки.
+    """
+    return queryset.filter(name__icontains=term).annotate(
+        prefix_rank=Case(
+            When(name__istartswith=term, then=Value(0)),
+            default=Value(1),
+        )
+    ).order_by('prefix_rank', 'name')
+
+
+class IngredientIndex:
+    """
+    Индекс названий ингредиентов в памяти процесса:
+    отсортированный массив ключей и поиск префикса через bisect.
+    В PostgreSQL он отвечает только на короткие запросы, длинные
+    выполняются в базе по триграммному индексу.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._items = []
+        self._enabled = False
+        self._loaded_at = None
+        self._version = None
+
+    def _is_stale(self):
+        return (
+            self._loaded_at is None
+            or self._version != ingredients_cache.get_version()
+            or monotonic() - self._loaded_at
+            > settings.INGREDIENT_SEARCH_INDEX_TTL
+        )
+
+    def _load(self):
+        """Загружает справочник, если он помещается в индекс."""
+        version = ingredients_cache.get_version()
+        enabled = (
+            connection.vendor != 'postgresql'
+            or Ingredient.objects.count()
+            <= settings.INGREDIENT_SEARCH_INDEX_MAX_SIZE
+        )
+        items = []
+        if enabled:
+            items = sorted(
+                Ingredient.objects.only('id', 'name', 'measurement_unit'),
+                key=lambda item: (item.name.lower(), item.measurement_unit)
+            )
+        self._keys = [item.name.lower() for item in items]
+        self._items = items
+        self._enabled = enabled
+        self._loaded_at = monotonic()
+        self._version = version
+
+    @property
+    def enabled(self):
+        if self._is_stale():
+            self._load()
+        return self._enabled
+
+    def serves(self, term):
+        """Отвечает ли индекс на запрос term."""
+        if (
+            connection.vendor == 'postgresql'
+            and len(term) > settings.INGREDIENT_SEARCH_INDEX_MAX_TERM
+        ):
+            return False
+        return self.enabled
+
+    def search(self, term):
+        """Возвращает ингредиенты: сначала по префиксу, затем по подстроке."""
+        if self._is_stale():
+            self._load()
+        keys, items = self._keys, self._items
+        term = term.lower()
+        start = bisect_left(keys, term)
+        end = bisect_left(keys, term + chr(sys.maxunicode), lo=start)
+        return items[start:end] + [
+            item for key, item in zip(keys, items)
+            if term in key and not key.startswith(term)
+        ]
+
+
+ingredient_index = IngredientIndex()
+
+
+def stem(word):
+    """
+    Грубая основа русского слова: отсекается самое длинное
+    окончание, если от слова остается не меньше трех букв.
+    """
+    for ending in RUSSIAN_WORD_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """Основы слов текста в нижнем регистре."""
+    return [stem(word) for word in WORD_RE.findall(text.lower().replace(
+        'ё', 'е'
+    ))]
+
+
+class RecipeSearchIndex:
+    """
+    Инвертированный индекс рецептов в памяти процесса для баз
+    без полнотекстового поиска PostgreSQL (SQLite в тестах).
+    Ранг рецепта — сумма весов полей, где встретились слова запроса.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._version = None
+
+    def _get_version(self):
+        return (recipes_cache.get_version(), ingredients_cache.get_version())
+
+    def _load(self):
+        version = self._get_version()
+        names = defaultdict(list)
+        for recipe_id, name in AmountIngredientInRecipe.objects.values_list(
+            'recipe_id', 'ingredient__name'
+        ):
+            names[recipe_id].append(name)
+        postings = defaultdict(dict)
+        for pk, name, text in Recipe.objects.values_list(
+            'pk', 'name', 'text'
+        ).iterator():
+            for field, content in (('name', name),
+                                   ('ingredients', ' '.join(names[pk])),
+                                   ('text', text)):
+                weight = RECIPE_SEARCH_WEIGHTS[field]
+                for token in set(tokenize(content)):
+                    postings[token][pk] = postings[token].get(pk, 0) + weight
+        self._postings = dict(postings)
+        self._version = version
+
+    def search(self, term):
+        """Id рецептов со всеми словами запроса по убыванию ранга."""
+        if self._version != self._get_version():
+            self._load()
+        scores = None
+        for token in set(tokenize(term)):
+            matches = self._postings.get(token, {})
+            if scores is None:
+                scores = dict(matches)
+            else:
+                scores = {pk: score + matches[pk]
+                          for pk, score in scores.items() if pk in matches}
+        return sorted(scores or {}, key=lambda pk: (-scores[pk], -pk))
+
+
+recipe_index = RecipeSearchIndex()
+
+
+def search_recipes(queryset, term):
+    """
+    Полнотекстовый поиск рецептов по названию, ингредиентам
+    и тексту, результаты упорядочены по рангу. В PostgreSQL
+    используется поисковый вектор с GIN-индексом, в других
+    базах — индекс в памяти.
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            term, config=RECIPE_SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', *CURSOR_ORDERING)
+    ids = recipe_index.search(term)
+    if not ids:
+        return queryset.none()
+    return queryset.filter(pk__in=ids).order_by(Case(
+        *[When(pk=pk, then=Value(position))
+          for position, pk in enumerate(ids)]
+    ))
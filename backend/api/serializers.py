@@ -1,16 +1,31 @@
 from django.contrib.auth import get_user_model
-from drf_extra_fields.fields import Base64ImageField
+from django.db import IntegrityError, transaction
+from recipes.images import image_url
 from recipes.models import (AmountIngredientInRecipe, Cart, Favorite,
-                            Ingredient, Recipe, Tag)
+                            Ingredient, Recipe, ShoppingCartIngredient, Tag)
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from users.models import Subscription
 
+from .cache import recipe_fragments, relation_cache
+from .constants import (MAX_BULK_RECIPES, MAX_COOKABLE_INGREDIENTS,
+                        MAX_COOKABLE_MISSING, MIN_INGREDIENT_AMOUNT)
+from .fields import StreamingBase64ImageField
+
 User = get_user_model()
 
 
+def relation_ids(context, relation):
+    """Множество id связи текущего пользователя из relation_cache."""
+    request = context.get('request')
+    if request is None:
+        return frozenset()
+    return relation_cache.get(request.user, relation)
+
+
 class ShortRecipeSerializer(serializers.ModelSerializer):
     """Упрощенное представление рецептов"""
-    image = Base64ImageField()
+    image = StreamingBase64ImageField()
 
     class Meta:
         model = Recipe
@@ -24,16 +39,26 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
 
 class AvatarSerializer(serializers.ModelSerializer):
     """Обработка аватара пользователя"""
-    avatar = Base64ImageField(required=True)
+    avatar = StreamingBase64ImageField(required=True)
 
     class Meta:
         model = User
         fields = ('avatar',)
 
 
+class RecipeImageSerializer(serializers.ModelSerializer):
+    """Замена изображения рецепта"""
+    image = StreamingBase64ImageField(required=True)
+
+    class Meta:
+        model = Recipe
+        fields = ('image',)
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Сериализатор профиля пользователя"""
     is_subscribed = serializers.SerializerMethodField()
+    avatar = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -47,15 +72,20 @@ class UserSerializer(serializers.ModelSerializer):
             'is_subscribed',
         )
 
+    def get_avatar(self, instance):
+        """URL уменьшенного аватара"""
+        return image_url(
+            self.context.get('request'),
+            instance.avatar,
+            instance.avatar_variants,
+            'small'
+        ) or None
+
     def get_is_subscribed(self, instance):
         """Проверка подписки на пользователя"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Subscription.objects.filter(
-                author=instance,
-                subscribers=request.user
-            ).exists()
-        return False
+        if hasattr(instance, 'is_subscribed'):
+            return instance.is_subscribed
+        return instance.pk in relation_ids(self.context, 'subscriptions')
 
 
 class FollowCreateSerializer(serializers.Serializer):
@@ -71,44 +101,33 @@ class FollowCreateSerializer(serializers.Serializer):
             raise serializers.ValidationError(
                 "Подписка на себя невозможна."
             )
-        if Subscription.objects.filter(
-                subscribers=request.user,
-                author=target_user).exists():
-            raise serializers.ValidationError(
-                "Подписка уже существует."
-            )
         return attrs
 
     def create(self, validated_data):
-        """Создание новой подписки"""
+        """
+        Создание новой подписки. Повтор отсекает ограничение
+        уникальности в базе, без предварительной проверки.
+        """
         request = self.context['request']
         target_user = self.context['author']
-
-        return Subscription.objects.create(subscribers=request.user,
-                                           author=target_user)
-
-
-class FollowTerminationValidator(serializers.Serializer):
-    """Валидатор отмены подписки"""
-
-    def validate(self, attrs):
-        """Проверка существования подписки"""
-        request = self.context['request']
-        target_user = self.context['author']
-
-        if not Subscription.objects.filter(subscribers=request.user,
-                                           author=target_user).exists():
-            raise serializers.ValidationError(
-                "Подписка не найдена"
-            )
-        return attrs
+        try:
+            with transaction.atomic():
+                return Subscription.objects.create(
+                    subscribers=request.user, author=target_user
+                )
+        except IntegrityError:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    "Подписка уже существует."
+                ]
+            })
 
 
 class FollowSerializer(serializers.ModelSerializer):
     """Представление подписок"""
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
     avatar = serializers.SerializerMethodField()
 
     class Meta:
@@ -127,22 +146,19 @@ class FollowSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, instance):
         """Проверка активной подписки"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Subscription.objects.filter(
-                subscribers=request.user,
-                author=instance
-            ).exists()
-        return False
+        if hasattr(instance, 'is_subscribed'):
+            return instance.is_subscribed
+        return instance.pk in relation_ids(self.context, 'subscriptions')
 
     def get_recipes(self, instance):
         """Получение рецептов с ограничением"""
-        request = self.context.get("request")
-        limit = request.GET.get("recipes_limit")
-        recipe_set = instance.recipes.all()
-
-        if limit and limit.isdigit():
-            recipe_set = recipe_set[:int(limit)]
+        recipe_set = getattr(instance, 'limited_recipes', None)
+        if recipe_set is None:
+            request = self.context.get("request")
+            limit = request.GET.get("recipes_limit")
+            recipe_set = instance.recipes.all()
+            if limit and limit.isdigit():
+                recipe_set = recipe_set[:int(limit)]
 
         return RecipeCustomSerializer(
             recipe_set,
@@ -150,17 +166,14 @@ class FollowSerializer(serializers.ModelSerializer):
             context=self.context
         ).data
 
-    def get_recipes_count(self, instance):
-        """Подсчет рецептов пользователя"""
-        return instance.recipes.count()
-
     def get_avatar(self, instance):
         """Получение URL аватара"""
-        avatar_serializer = AvatarSerializer(
-            instance,
-            context=self.context
-        )
-        return avatar_serializer.data.get('avatar')
+        return image_url(
+            self.context.get('request'),
+            instance.avatar,
+            instance.avatar_variants,
+            'small'
+        ) or None
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -199,6 +212,32 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
                   'amount')
 
 
+class RecipeFragmentListSerializer(serializers.ListSerializer):
+    """
+    Список рецептов из общих для всех пользователей фрагментов
+    с наложенными флагами текущего пользователя.
+    """
+
+    def to_representation(self, data):
+        favorites = relation_ids(self.context, 'favorites')
+        cart = relation_ids(self.context, 'cart')
+        subscriptions = relation_ids(self.context, 'subscriptions')
+        return [
+            {
+                **fragment,
+                'author': {
+                    **fragment['author'],
+                    'is_subscribed': (
+                        fragment['author']['id'] in subscriptions
+                    ),
+                },
+                'is_favorited': fragment['id'] in favorites,
+                'is_in_shopping_cart': fragment['id'] in cart,
+            }
+            for fragment in recipe_fragments.get_many(data, self.child)
+        ]
+
+
 class RecipeDetailSerializer(serializers.ModelSerializer):
     """Детальное представление рецепта"""
     author = serializers.SerializerMethodField()
@@ -226,37 +265,54 @@ class RecipeDetailSerializer(serializers.ModelSerializer):
             "text",
             "cooking_time"
         ]
+        list_serializer_class = RecipeFragmentListSerializer
 
     def get_image(self, obj):
-        """Генерация URL изображения"""
-        if obj.image:
-            request = self.context.get('request')
-            return request.build_absolute_uri(
-                obj.image.url) if request else obj.image.url
-        return ""
+        """Генерация URL изображения подходящего размера"""
+        return image_url(
+            self.context.get('request'),
+            obj.image,
+            obj.image_variants,
+            self.context.get('image_size', 'large')
+        )
 
     def get_is_favorited(self, obj):
         """Проверка наличия в избранном"""
-        user = self.context["request"].user
-        return user.is_authenticated and Favorite.objects.filter(
-            user=user, recipe=obj
-        ).exists()
+        return obj.pk in relation_ids(self.context, 'favorites')
 
     def get_is_in_shopping_cart(self, obj):
         """Проверка наличия в корзине"""
-        user = self.context["request"].user
-        return user.is_authenticated and Cart.objects.filter(
-            user=user, recipe=obj
-        ).exists()
+        return obj.pk in relation_ids(self.context, 'cart')
 
     def get_author(self, obj):
         """Используем author"""
         return UserSerializer(obj.author, context=self.context).data
 
 
+class CookableRecipeSerializer(RecipeDetailSerializer):
+    """Рецепт в подборке по имеющимся ингредиентам"""
+    missing_ingredients = serializers.IntegerField(read_only=True)
+    missing = serializers.SerializerMethodField()
+
+    class Meta(RecipeDetailSerializer.Meta):
+        fields = RecipeDetailSerializer.Meta.fields + [
+            "missing_ingredients",
+            "missing",
+        ]
+        list_serializer_class = serializers.ListSerializer
+
+    def get_missing(self, obj):
+        """Id недостающих ингредиентов из уже загруженного состава"""
+        available = self.context['available_ingredients']
+        return [
+            row.ingredient_id for row in obj.recipes_with_ingredient.all()
+            if row.ingredient_id not in available
+        ]
+
+
 class RecipeEditorSerializer(serializers.ModelSerializer):
     """Редактор рецептов"""
-    image = Base64ImageField(required=True)
+    image = StreamingBase64ImageField(required=True)
     ingredients = serializers.ListField(
         child=serializers.DictField(),
         write_only=True,
@@ -287,29 +343,30 @@ class RecipeEditorSerializer(serializers.ModelSerializer):
         if not items:
             raise serializers.ValidationError("Требуются ингредиенты")
 
-        ids = [item['id'] for item in items]
-        if len(ids) != len(set(ids)):
-            raise serializers.ValidationError("Дубликаты ингредиентов")
-
         validated = []
         for item in items:
             if 'id' not in item or 'amount' not in item:
                 raise serializers.ValidationError(
                     "Неполные данные ингредиента")
-
             try:
-                ingredient = Ingredient.objects.get(id=item['id'])
-            except Ingredient.DoesNotExist:
+                ingredient_id = int(item['id'])
+                amount = int(item['amount'])
+            except (TypeError, ValueError):
                 raise serializers.ValidationError(
-                    f"Ингредиент {item['id']} не найден")
-
-            if int(item['amount']) <= 0:
+                    "Некорректные данные ингредиента")
+            if amount < MIN_INGREDIENT_AMOUNT:
                 raise serializers.ValidationError("Некорректное количество")
+            validated.append({'id': ingredient_id, 'amount': amount})
 
-            validated.append({
-                'id': ingredient.id,
-                'amount': item['amount']
-            })
+        ids = [item['id'] for item in validated]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Дубликаты ингредиентов")
+
+        found = Ingredient.objects.in_bulk(ids)
+        for ingredient_id in ids:
+            if ingredient_id not in found:
+                raise serializers.ValidationError(
+                    f"Ингредиент {ingredient_id} не найден")
         return validated
 
     def validate(self, data):
@@ -351,18 +408,49 @@ class RecipeEditorSerializer(serializers.ModelSerializer):
             ) for item in ingredients
         ])
 
+    @transaction.atomic
     def create(self, validated_data):
         """Создание рецепта"""
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(
             author=self.context['request'].user,
+            ingredients_count=len(ingredients),
             **validated_data
         )
         recipe.tags.set(tags)
         self.process_ingredients(recipe, ingredients)
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """
+        Обновление ингредиентов рецепта по разнице со старым
+        составом: вставляются, меняются и удаляются только
+        затронутые строки.
+        """
+        current = {
+            row.ingredient_id: row
+            for row in recipe.recipes_with_ingredient.all()
+        }
+        amounts = {item['id']: item['amount'] for item in ingredients}
+
+        removed = current.keys() - amounts.keys()
+        if removed:
+            AmountIngredientInRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        self.process_ingredients(recipe, [
+            item for item in ingredients if item['id'] not in current
+        ])
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        AmountIngredientInRecipe.objects.bulk_update(changed, ['amount'])
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Обновление рецепта"""
         ingredients = validated_data.pop('ingredients', None)
@@ -372,8 +460,12 @@ class RecipeEditorSerializer(serializers.ModelSerializer):
             instance.tags.set(tags)
 
         if ingredients is not None:
-            instance.recipes_with_ingredient.all().delete()
-            self.process_ingredients(instance, ingredients)
+            with ShoppingCartIngredient.objects.track_recipe(instance):
+                self.update_ingredients(instance, ingredients)
+            Recipe.objects.filter(
+                pk=instance.pk
+            ).update(ingredients_count=len(ingredients))
+            instance.ingredients_count = len(ingredients)
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
@@ -402,19 +494,18 @@ class RecipeMinimalSerializer(serializers.ModelSerializer):
                   'cooking_time')
 
     def get_image(self, obj):
-        """Обработка изображения"""
-        request = self.context.get('request')
-        if not obj.image:
-            return ""
-        return request.build_absolute_uri(
-            obj.image.url) if request else obj.image.url
+        """Обработка изображения: уменьшенная копия для карточек"""
+        return image_url(
+            self.context.get('request'),
+            obj.image,
+            obj.image_variants,
+            'small'
+        )
 
 
 class RecipeCustomSerializer(RecipeMinimalSerializer):
     """Сериализатор для кастомного отображения рецептов"""
 
-    image = Base64ImageField()
-
     class Meta(RecipeMinimalSerializer.Meta):
         pass
 
@@ -426,15 +517,21 @@ class BaseUserRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         fields = ('user',
                   'recipe')
-        read_only_fields = ('user',)
+        read_only_fields = ('user', 'recipe')
 
-    def validate(self, data):
-        """Проверка уникальности"""
-        user = data['user']
-        recipe = data['recipe']
-        if self.Meta.model.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError("Уже существует")
-        return data
+    def create(self, validated_data):
+        """
+        Вставка без предварительной проверки: повтор отсекает
+        ограничение уникальности, и ответ остается 400 даже
+        при одновременных запросах. Рецепт передается в save().
+        """
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ["Уже существует"]
+            })
 
     def to_representation(self, instance):
         return RecipeMinimalSerializer(
@@ -453,3 +550,32 @@ class CartItemsSerializer(BaseUserRecipeSerializer):
     """Сериализатор корзины"""
     class Meta(BaseUserRecipeSerializer.Meta):
         model = Cart
+
+
+class BulkRecipeListSerializer(serializers.Serializer):
+    """Список рецептов для массового изменения избранного или корзины"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES,
+    )
+
+    def validate_recipes(self, value):
+        """Повторы убираются, порядок сохраняется"""
+        return list(dict.fromkeys(value))
+
+
+class CookableQuerySerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_COOKABLE_INGREDIENTS,
+    )
+    max_missing = serializers.IntegerField(
+        min_value=0, max_value=MAX_COOKABLE_MISSING, default=0
+    )
+
+    def validate_ingredients(self, value):
+        """Повторы убираются"""
+        return list(dict.fromkeys(value))
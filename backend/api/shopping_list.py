@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+from recipes.models import ShoppingCartIngredient
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.negotiation import DefaultContentNegotiation
+
+from .constants import (SHOPPING_LIST_CHUNK_SIZE, SHOPPING_LIST_FILENAME,
+                        SHOPPING_LIST_TITLE)
+
+
+def get_shopping_list(user):
+    """
+    Возвращает итератор по суммарному количеству ингредиентов
+    из корзины пользователя, упорядоченный по названию.
+    """
+    return ShoppingCartIngredient.objects.filter(
+        user=user
+    ).values(
+        'ingredient__name',
+        'ingredient__measurement_unit'
+    ).annotate(
+        total=F('amount')
+    ).order_by(
+        'ingredient__name',
+        'ingredient__measurement_unit'
+    ).iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+
+
+async def iterate_async(chunks):
+    """
+    Асинхронная обертка потока выгрузки для ASGI: синхронный
+    StreamingHttpResponse там собирается в память целиком.
+    Части берутся пачками по SHOPPING_LIST_CHUNK_SIZE в одном
+    потоке sync_to_async, где открыт курсор базы.
+    """
+    take = sync_to_async(
+        lambda: list(islice(chunks, SHOPPING_LIST_CHUNK_SIZE)),
+        thread_sensitive=True,
+    )
+    while batch := await take():
+        for chunk in batch:
+            yield chunk
+
+
+class ShoppingListRenderer:
+    """Базовый формат выгрузки списка покупок."""
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+
+    @property
+    def filename(self):
+        return f'{SHOPPING_LIST_FILENAME}.{self.extension}'
+
+    def render(self, rows):
+        """Построчно отдает содержимое файла."""
+        yield f'{SHOPPING_LIST_TITLE}:\n\n'
+        for row in rows:
+            yield (
+                f"{row['ingredient__name']} "
+                f"({row['ingredient__measurement_unit']}) - "
+                f"{row['total']}\n"
+            )
+
+
+class _Echo:
+    """Псевдобуфер, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    """Выгрузка списка покупок в CSV."""
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def render(self, rows):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(('name', 'measurement_unit', 'amount'))
+        for row in rows:
+            yield writer.writerow((
+                row['ingredient__name'],
+                row['ingredient__measurement_unit'],
+                row['total'],
+            ))
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    """Выгрузка списка покупок в JSON."""
+    content_type = 'application/json'
+    extension = 'json'
+
+    def render(self, rows):
+        yield '['
+        separator = ''
+        for row in rows:
+            yield separator + json.dumps({
+                'name': row['ingredient__name'],
+                'measurement_unit': row['ingredient__measurement_unit'],
+                'amount': row['total'],
+            }, ensure_ascii=False)
+            separator = ','
+        yield ']'
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    """
+    Выгрузка списка покупок в PDF.
+
+    Таблица ссылок PDF пишется в конце файла, поэтому документ
+    собирается целиком и затем отдается частями.
+    """
+    content_type = 'application/pdf'
+    extension = 'pdf'
+    font_size = 12
+    margin = 50
+    line_height = 18
+
+    def get_font(self):
+        """Регистрирует шрифт с кириллицей, если он доступен."""
+        font_path = settings.SHOPPING_LIST_PDF_FONT
+        if not os.path.exists(font_path):
+            return 'Helvetica'
+        font_name = os.path.splitext(os.path.basename(font_path))[0]
+        if font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(font_name, font_path))
+        return font_name
+
+    def render(self, rows):
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        _, height = A4
+        y = height - self.margin
+        for line in super().render(rows):
+            if y < self.margin:
+                pdf.showPage()
+                y = height - self.margin
+            pdf.setFont(font, self.font_size)
+            pdf.drawString(self.margin, y, line.rstrip('\n'))
+            y -= self.line_height
+        pdf.save()
+        buffer.seek(0)
+        while chunk := buffer.read(SHOPPING_LIST_CHUNK_SIZE):
+            yield chunk
+
+
+SHOPPING_LIST_RENDERERS = {
+    'txt': ShoppingListRenderer,
+    'csv': CSVShoppingListRenderer,
+    'json': JSONShoppingListRenderer,
+    'pdf': PDFShoppingListRenderer,
+}
+
+
+class ShoppingListNegotiation(DefaultContentNegotiation):
+    """
+    Согласование формата, не использующее параметр ?format=:
+    он выбирает формат выгрузки, а не рендерер DRF.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
@@ -0,0 +1,72 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipes.models import Cart, Favorite, Ingredient, Recipe, Tag
+from users.models import Subscription
+
+from .cache import (ingredients_cache, recipes_cache, relation_cache,
+                    short_link_cache, tags_cache)
+from .metrics import install_query_recorder
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients_cache(sender, **kwargs):
+    """
+    Сбрасывает кэш ингредиентов после изменений;
+    индекс поиска перестраивается по смене версии кэша.
+    """
+    ingredients_cache.invalidate()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags_cache(sender, **kwargs):
+    """Сбрасывает кэш тегов после изменений."""
+    tags_cache.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipes_cache(sender, **kwargs):
+    """
+    Меняет версию рецептов после фиксации транзакции,
+    когда ингредиенты рецепта уже сохранены.
+    """
+    transaction.on_commit(recipes_cache.invalidate)
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_short_link(sender, instance, **kwargs):
+    """Удаляет короткую ссылку удаленного рецепта из кэша."""
+    if instance.short_link:
+        short_link_cache.forget(instance.short_link)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Cart)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Cart)
+@receiver(post_delete, sender=Subscription)
+def invalidate_user_relations(sender, instance, **kwargs):
+    """
+    Сбрасывает множество связей пользователя после фиксации
+    транзакции: иначе параллельный запрос успел бы закэшировать
+    данные без этого изменения. Массовые изменения обходят
+    сигналы и сбрасывают кэш сами, один раз на пачку.
+    """
+    transaction.on_commit(partial(
+        relation_cache.invalidate, sender, relation_cache.owner_id(instance)
+    ))
+
+
+@receiver(connection_created)
+def record_request_queries(sender, connection, **kwargs):
+    """Подключает учет SQL-запросов к новому соединению."""
+    if settings.METRICS_ENABLED:
+        install_query_recorder(connection)
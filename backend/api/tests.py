@@ -0,0 +1,732 @@
+import io
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from PIL import Image
+from recipes.images import IMAGE_FORMATS
+from recipes.models import (AmountIngredientInRecipe, Cart, Favorite,
+                            Ingredient, Recipe, ShoppingCartIngredient, Tag)
+from rest_framework.authtoken.models import Token
+from users.models import Subscription, User
+
+from . import async_views
+from .constants import IMAGE_SIZES
+from .search import ingredient_index, search_ingredients
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+}})
+class RecipeTestData(TestCase):
+    """
+    Авторы, теги, ингредиенты и рецепты для тестов API. Кэш
+    в памяти процесса: setUp очищает его, не трогая общий Redis.
+    """
+    recipes_count = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='pass',
+        )
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов', password='pass',
+        )
+        cls.token = Token.objects.create(user=cls.reader)
+        cls.author_token = Token.objects.create(user=cls.author)
+        cls.tags = [
+            Tag.objects.create(name='Завтрак'),
+            Tag.objects.create(name='Обед'),
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name='Мука', measurement_unit='г'),
+            Ingredient.objects.create(name='Молоко', measurement_unit='мл'),
+            Ingredient.objects.create(name='Яйца', measurement_unit='шт'),
+        ]
+        cls.recipes = []
+        for index in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                author=cls.author if index % 2 else cls.reader,
+                name=f'Рецепт {index}',
+                text='Описание',
+                cooking_time=10 + index,
+                ingredients_count=len(cls.ingredients),
+            )
+            recipe.tags.set([cls.tags[index % len(cls.tags)]])
+            AmountIngredientInRecipe.objects.bulk_create(
+                AmountIngredientInRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=index + 1
+                )
+                for ingredient in cls.ingredients
+            )
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipes[0])
+        Cart.objects.create(user=cls.reader, recipe=cls.recipes[1])
+
+    def setUp(self):
+        caches[settings.REFERENCE_CACHE_ALIAS].clear()
+
+    def auth_headers(self, token=None):
+        token = token or self.token
+        return {'Authorization': f'Token {token.key}'}
+
+
+class AsyncRecipeViewsTest(RecipeTestData):
+    """Асинхронное чтение рецептов отвечает так же, как RecipeViewSet."""
+
+    def get_async(self, view, path, headers=None, **kwargs):
+        request = AsyncRequestFactory().get(path, headers=headers)
+        response = async_to_sync(view)(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def assert_same_response(self, view, path, headers=None, **kwargs):
+        expected = self.client.get(path, headers=headers)
+        response = self.get_async(view, path, headers, **kwargs)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(json.loads(response.content), expected.json())
+        for header in ('ETag', 'Last-Modified', 'Cache-Control', 'Vary'):
+            self.assertEqual(response.get(header), expected.get(header))
+        return response
+
+    def test_recipe_list(self):
+        paths = (
+            '/api/recipes/',
+            '/api/recipes/?limit=2',
+            '/api/recipes/?limit=2&page=2',
+            f'/api/recipes/?tags={self.tags[0].slug}',
+            f'/api/recipes/?author={self.author.pk}',
+            '/api/recipes/?is_favorited=1',
+            '/api/recipes/?is_in_shopping_cart=1',
+        )
+        for headers in ({}, self.auth_headers()):
+            for path in paths:
+                with self.subTest(path=path, headers=headers):
+                    self.assert_same_response(
+                        async_views.recipe_list, path, headers
+                    )
+
+    def test_recipe_list_fallback(self):
+        for path in ('/api/recipes/?page=100', '/api/recipes/?author=x'):
+            with self.subTest(path=path):
+                self.assert_same_response(async_views.recipe_list, path)
+
+    def test_recipe_detail(self):
+        recipe = self.recipes[0]
+        path = f'/api/recipes/{recipe.pk}/'
+        for headers in ({}, self.auth_headers()):
+            with self.subTest(headers=headers):
+                response = self.assert_same_response(
+                    async_views.recipe_detail, path, headers, pk=recipe.pk
+                )
+                not_modified = self.get_async(
+                    async_views.recipe_detail,
+                    path,
+                    {**headers, 'If-None-Match': response['ETag']},
+                    pk=recipe.pk,
+                )
+                self.assertEqual(not_modified.status_code, 304)
+        self.assert_same_response(
+            async_views.recipe_detail, '/api/recipes/0/', pk=0
+        )
+
+
+class RecipeListQueriesTest(RecipeTestData):
+    """
+    Число запросов списка рецептов не зависит от размера страницы:
+    автор, теги, ингредиенты и флаги пользователя не загружаются
+    отдельным запросом на каждый рецепт.
+    """
+    page_sizes = (2, RecipeTestData.recipes_count)
+
+    def assert_list_queries(self, headers, cold, warm):
+        for page_size in self.page_sizes:
+            path = f'/api/recipes/?limit={page_size}'
+            with self.subTest(page_size=page_size):
+                caches[settings.REFERENCE_CACHE_ALIAS].clear()
+                with self.assertNumQueries(cold):
+                    response = self.client.get(path, headers=headers)
+                self.assertEqual(len(response.json()['results']), page_size)
+                with self.assertNumQueries(warm):
+                    self.client.get(path, headers=headers)
+
+    def test_anonymous(self):
+        # Версия, COUNT и страница, при пустом кэше фрагментов
+        # еще рецепты, теги и ингредиенты.
+        self.assert_list_queries({}, cold=6, warm=3)
+
+    def test_authenticated(self):
+        # Дополнительно токен и, при пустом кэше, связи пользователя.
+        self.assert_list_queries(self.auth_headers(), cold=8, warm=4)
+
+
+class CartTotalsTest(RecipeTestData):
+    """
+    Суммы ингредиентов корзины после добавления, удаления рецептов
+    и изменения их состава совпадают с пересчетом rebuild().
+    """
+
+    def assert_totals_rebuilt(self):
+        totals = ShoppingCartIngredient.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        )
+        current = set(totals)
+        ShoppingCartIngredient.objects.rebuild()
+        self.assertEqual(current, set(totals))
+
+    def test_add_and_remove(self):
+        headers = self.auth_headers()
+        for recipe in self.recipes[2:4]:
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/', headers=headers
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assert_totals_rebuilt()
+        bulk = {'recipes': [recipe.pk for recipe in self.recipes[3:6]]}
+        self.client.post(
+            '/api/recipes/shopping_cart/', bulk,
+            content_type='application/json', headers=headers,
+        )
+        self.assert_totals_rebuilt()
+        self.client.delete(
+            f'/api/recipes/{self.recipes[2].pk}/shopping_cart/',
+            headers=headers,
+        )
+        self.assert_totals_rebuilt()
+        self.client.delete(
+            '/api/recipes/shopping_cart/', bulk,
+            content_type='application/json', headers=headers,
+        )
+        self.assert_totals_rebuilt()
+        self.assertEqual(
+            set(ShoppingCartIngredient.objects.filter(
+                user=self.reader
+            ).values_list('ingredient_id', 'amount')),
+            {(ingredient.pk, 2) for ingredient in self.ingredients},
+        )
+
+    def test_ingredient_edit(self):
+        recipe = self.recipes[1]
+        extra = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        flour, milk, _ = self.ingredients
+        response = self.client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {
+                'tags': [self.tags[0].pk],
+                'cooking_time': 5,
+                'ingredients': [
+                    {'id': flour.pk, 'amount': 10},
+                    {'id': milk.pk, 'amount': 2},
+                    {'id': extra.pk, 'amount': 3},
+                ],
+            },
+            content_type='application/json',
+            headers=self.auth_headers(self.author_token),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assert_totals_rebuilt()
+        self.assertEqual(
+            set(ShoppingCartIngredient.objects.filter(
+                user=self.reader
+            ).values_list('ingredient_id', 'amount')),
+            {(flour.pk, 10), (milk.pk, 2), (extra.pk, 3)},
+        )
+
+    def test_apply_delta(self):
+        flour, milk, eggs = self.ingredients
+        totals = ShoppingCartIngredient.objects.filter(user=self.author)
+        ShoppingCartIngredient.objects.apply_delta(
+            [self.author.pk], {flour.pk: 5, milk.pk: 2}
+        )
+        ShoppingCartIngredient.objects.apply_delta(
+            [self.author.pk], {flour.pk: 1, milk.pk: -2, eggs.pk: -1}
+        )
+        self.assertEqual(
+            set(totals.values_list('ingredient_id', 'amount')),
+            {(flour.pk, 6)},
+        )
+
+
+class CookableRecipesTest(RecipeTestData):
+    """Подбор рецептов по имеющимся ингредиентам."""
+
+    def setUp(self):
+        super().setUp()
+        self.flour, self.milk, self.eggs = self.ingredients
+        # В первом рецепте нет яиц: для него хватает муки и молока.
+        AmountIngredientInRecipe.objects.filter(
+            recipe=self.recipes[0], ingredient=self.eggs
+        ).delete()
+        Recipe.objects.filter(pk=self.recipes[0].pk).update_ingredients_count()
+
+    def get_cookable(self, *ingredients, **params):
+        ids = ','.join(str(ingredient.pk) for ingredient in ingredients)
+        response = self.client.get(
+            '/api/recipes/cookable/',
+            {'ingredients': ids, 'limit': self.recipes_count, **params},
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (recipe['id'], recipe['missing_ingredients'], recipe['missing'])
+            for recipe in response.json()['results']
+        ]
+
+    def test_all_ingredients(self):
+        results = self.get_cookable(self.flour, self.milk, self.eggs)
+        self.assertCountEqual(
+            results, [(recipe.pk, 0, []) for recipe in self.recipes]
+        )
+
+    def test_missing_one(self):
+        self.assertEqual(
+            self.get_cookable(self.flour, self.milk),
+            [(self.recipes[0].pk, 0, [])],
+        )
+
+    def test_max_missing(self):
+        results = self.get_cookable(self.flour, self.milk, max_missing=1)
+        self.assertEqual(results[0], (self.recipes[0].pk, 0, []))
+        self.assertCountEqual(
+            results[1:],
+            [(recipe.pk, 1, [self.eggs.pk]) for recipe in self.recipes[1:]],
+        )
+
+    def test_deleted_ingredient(self):
+        self.eggs.delete()
+        self.assertCountEqual(
+            self.get_cookable(self.flour, self.milk),
+            [(recipe.pk, 0, []) for recipe in self.recipes],
+        )
+
+
+class IngredientSearchTest(RecipeTestData):
+    """
+    Поиск ингредиентов по названию: сначала совпадения по началу,
+    затем по вхождению подстроки, одинаково в индексе и в базе.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Названия в нижнем регистре, как в справочнике: LIKE в SQLite
+        # не учитывает регистр только для латиницы.
+        for name in ('тростниковый сахар', 'сахарная пудра', 'сахар'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    expected = ['сахар', 'сахарная пудра', 'тростниковый сахар']
+
+    def test_endpoint(self):
+        response = self.client.get('/api/ingredients/', {'name': 'сахар'})
+        self.assertEqual(
+            [item['name'] for item in response.json()], self.expected
+        )
+
+    def test_index_and_database(self):
+        for found in (
+            ingredient_index.search('сахар'),
+            search_ingredients(Ingredient.objects.all(), 'сахар'),
+        ):
+            with self.subTest(found=found):
+                self.assertEqual(
+                    [item.name for item in found], self.expected
+                )
+
+    def test_postgresql_long_terms(self):
+        with mock.patch('api.search.connection') as connection:
+            connection.vendor = 'postgresql'
+            self.assertTrue(ingredient_index.serves('са'))
+            self.assertFalse(ingredient_index.serves('сах'))
+
+
+@override_settings(IMAGE_PROCESSING_WORKERS=0)
+class RecipeImageVariantsTest(RecipeTestData):
+    """
+    Загруженное изображение уменьшается до всех размеров, и каждый
+    ответ отдает вариант своего размера.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        buffer = io.BytesIO()
+        Image.new('RGB', (1600, 1000), 'orange').save(buffer, 'PNG')
+        self.recipe = self.recipes[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.image.save('dish.png', ContentFile(buffer.getvalue()))
+        self.recipe.refresh_from_db()
+
+    def test_variants(self):
+        storage = self.recipe.image.storage
+        variants = self.recipe.image_variants
+        self.assertEqual(variants['source'], self.recipe.image.name)
+        for size, max_side in IMAGE_SIZES.items():
+            with self.subTest(size=size):
+                self.assertEqual(set(variants[size]), set(IMAGE_FORMATS))
+                for name in variants[size].values():
+                    with storage.open(name) as variant:
+                        self.assertEqual(
+                            max(Image.open(variant).size), max_side
+                        )
+
+    def test_size_per_context(self):
+        variants = self.recipe.image_variants
+        detail = self.client.get(f'/api/recipes/{self.recipe.pk}/').json()
+        recipes = self.client.get(
+            '/api/recipes/', {'limit': self.recipes_count}
+        ).json()['results']
+        listed = next(
+            recipe for recipe in recipes if recipe['id'] == self.recipe.pk
+        )
+        added = self.client.post(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+            headers=self.auth_headers(),
+        ).json()
+        for response, size in ((detail, 'large'), (listed, 'medium'),
+                               (added, 'small')):
+            with self.subTest(size=size):
+                self.assertTrue(response['image'].endswith(
+                    variants[size][IMAGE_FORMATS[0]]
+                ))
+
+
+class FeedPaginationTest(RecipeTestData):
+    """Курсорная пагинация ленты рецептов."""
+
+    def walk(self, path):
+        ids = []
+        while path:
+            response = self.client.get(path).json()
+            ids += [recipe['id'] for recipe in response['results']]
+            path = response['next']
+        return ids
+
+    def test_cursor_with_equal_created_at(self):
+        # Курсор хранит created_at и смещение среди совпадений.
+        Recipe.objects.update(created_at=self.recipes[0].created_at)
+        self.assertEqual(
+            self.walk('/api/recipes/?cursor=&limit=4'),
+            sorted((recipe.pk for recipe in self.recipes), reverse=True),
+        )
+
+    def test_cursor_with_search(self):
+        path = '/api/recipes/?search=рецепт'
+        self.assertEqual(self.client.get(path).status_code, 200)
+        response = self.client.get(f'{path}&cursor=')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('search', response.json())
+
+
+class BulkRecipeListTest(RecipeTestData):
+    """
+    Массовое добавление и удаление рецептов: статус каждого рецепта
+    и счетчики меняются только для действительно измененных строк.
+    """
+
+    def request(self, method, action_type, recipe_ids):
+        response = getattr(self.client, method)(
+            f'/api/recipes/{action_type}/', {'recipes': recipe_ids},
+            content_type='application/json', headers=self.auth_headers(),
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (result['id'], result['status'])
+            for result in response.json()['results']
+        ]
+
+    def assert_counts(self, model, listed):
+        self.assertEqual(
+            set(model.objects.filter(
+                user=self.reader
+            ).values_list('recipe_id', flat=True)),
+            {recipe.pk for recipe in listed},
+        )
+        for recipe in self.recipes:
+            recipe.refresh_from_db()
+            self.assertEqual(
+                getattr(recipe, model.recipe_counter), int(recipe in listed)
+            )
+
+    def test_add_and_remove(self):
+        other, new, unlisted = (self.recipes[index] for index in (2, 3, 5))
+        missing = Recipe.objects.order_by('pk').last().pk + 1
+        for action_type, model, listed in (
+            ('favorite', Favorite, self.recipes[0]),
+            ('shopping_cart', Cart, self.recipes[1]),
+        ):
+            with self.subTest(action_type=action_type):
+                self.assertEqual(
+                    self.request('post', action_type, [
+                        listed.pk, other.pk, new.pk, missing, other.pk
+                    ]),
+                    [(listed.pk, 'already_in_list'), (other.pk, 'added'),
+                     (new.pk, 'added'), (missing, 'not_found')],
+                )
+                self.assert_counts(model, [listed, other, new])
+                self.assertEqual(
+                    self.request('delete', action_type, [
+                        listed.pk, other.pk, unlisted.pk
+                    ]),
+                    [(listed.pk, 'removed'), (other.pk, 'removed'),
+                     (unlisted.pk, 'not_in_list')],
+                )
+                self.assert_counts(model, [new])
+
+
+class DuplicateRelationTest(RecipeTestData):
+    """
+    Повторное добавление упирается в ограничение уникальности
+    и отвечает 400 без изменения счетчиков.
+    """
+
+    def post(self, path):
+        return self.client.post(path, headers=self.auth_headers())
+
+    def assert_duplicate(self, response):
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.json())
+
+    def test_recipe_lists(self):
+        for action_type, model, recipe in (
+            ('favorite', Favorite, self.recipes[0]),
+            ('shopping_cart', Cart, self.recipes[1]),
+        ):
+            with self.subTest(action_type=action_type):
+                self.assert_duplicate(
+                    self.post(f'/api/recipes/{recipe.pk}/{action_type}/')
+                )
+                self.assertEqual(model.objects.filter(
+                    user=self.reader, recipe=recipe
+                ).count(), 1)
+                recipe.refresh_from_db()
+                self.assertEqual(getattr(recipe, model.recipe_counter), 1)
+
+    def test_subscription(self):
+        path = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.post(path).status_code, 201)
+        self.assert_duplicate(self.post(path))
+        self.assertEqual(
+            Subscription.objects.filter(subscribers=self.reader).count(), 1
+        )
+
+    def test_remove_missing(self):
+        recipe = self.recipes[2]
+        for path, expected in (
+            (f'/api/recipes/{recipe.pk}/favorite/', 400),
+            (f'/api/recipes/{recipe.pk}/shopping_cart/', 400),
+            (f'/api/users/{self.author.pk}/subscribe/', 400),
+            (f'/api/recipes/{recipe.pk + 100}/favorite/', 404),
+            (f'/api/users/{self.author.pk + 100}/subscribe/', 404),
+        ):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.delete(
+                    path, headers=self.auth_headers()
+                ).status_code, expected)
+
+
+class RelationCacheTest(RecipeTestData):
+    """
+    Флаги избранного, корзины и подписки в ответах обновляются
+    сразу после изменения связей, хотя множества связей кэшируются.
+    """
+
+    def flags(self, recipe):
+        data = self.client.get(
+            f'/api/recipes/{recipe.pk}/', headers=self.auth_headers()
+        ).json()
+        return (data['is_favorited'], data['is_in_shopping_cart'],
+                data['author']['is_subscribed'])
+
+    def change(self, method, path, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                path, data, content_type='application/json',
+                headers=self.auth_headers(),
+            )
+        self.assertLess(response.status_code, 300)
+
+    def test_single_changes(self):
+        recipe = self.recipes[3]
+        self.assertEqual(self.flags(recipe), (False, False, False))
+        self.change('post', f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(self.flags(recipe), (True, False, False))
+        self.change('post', f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertEqual(self.flags(recipe), (True, True, False))
+        self.change('post', f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.flags(recipe), (True, True, True))
+        self.change('delete', f'/api/recipes/{recipe.pk}/favorite/')
+        self.change('delete', f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.change('delete', f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.flags(recipe), (False, False, False))
+
+    def test_bulk_changes(self):
+        recipe = self.recipes[3]
+        self.assertEqual(self.flags(recipe), (False, False, False))
+        for method, expected in (('post', True), ('delete', False)):
+            for action_type in ('favorite', 'shopping_cart'):
+                self.change(
+                    method, f'/api/recipes/{action_type}/',
+                    {'recipes': [recipe.pk]},
+                )
+            self.assertEqual(self.flags(recipe), (expected, expected, False))
+
+    def test_other_user_unaffected(self):
+        recipe = self.recipes[3]
+        self.flags(recipe)
+        Favorite.objects.create(user=self.author, recipe=recipe)
+        self.assertEqual(self.flags(recipe), (False, False, False))
+
+
+class ConditionalResponseTest(RecipeTestData):
+    """
+    ETag, Last-Modified, Cache-Control и Vary ответов с рецептами
+    и пользователями, 304 при актуальной версии у клиента.
+    """
+    paths = ('/api/recipes/', '/api/recipes/{recipe}/', '/api/users/{user}/')
+
+    def get(self, path, headers=None):
+        return self.client.get(path.format(
+            recipe=self.recipes[0].pk, user=self.author.pk
+        ), headers=headers)
+
+    def assert_not_modified(self, path, headers, response):
+        for condition in (
+            {'If-None-Match': response['ETag']},
+            {'If-Modified-Since': response['Last-Modified']},
+        ):
+            with self.subTest(condition=condition):
+                not_modified = self.get(path, {**headers, **condition})
+                self.assertEqual(not_modified.status_code, 304)
+                self.assertEqual(not_modified['ETag'], response['ETag'])
+                self.assertFalse(not_modified.content)
+
+    def test_anonymous(self):
+        for path in self.paths:
+            with self.subTest(path=path):
+                response = self.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    response['Cache-Control'],
+                    f'public, max-age={settings.PUBLIC_CACHE_MAX_AGE}',
+                )
+                self.assertIn('Authorization', response['Vary'])
+                self.assert_not_modified(path, {}, response)
+
+    def test_authenticated(self):
+        headers = self.auth_headers()
+        for path in self.paths:
+            with self.subTest(path=path):
+                response = self.get(path, headers)
+                self.assertEqual(
+                    response['Cache-Control'], 'private, no-cache'
+                )
+                self.assertIn('Authorization', response['Vary'])
+                self.assertNotEqual(response['ETag'], self.get(path)['ETag'])
+                self.assert_not_modified(path, headers, response)
+
+    def test_version_changes(self):
+        headers = self.auth_headers()
+        path = '/api/recipes/{recipe}/'
+        etag = self.get(path, headers)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.filter(user=self.reader).delete()
+        self.assertNotEqual(self.get(path, headers)['ETag'], etag)
+        list_etag = self.get('/api/recipes/')['ETag']
+        self.recipes[5].delete()
+        self.assertNotEqual(self.get('/api/recipes/')['ETag'], list_etag)
+        list_etag = self.get('/api/recipes/')['ETag']
+        self.author.first_name = 'Автор2'
+        self.author.save()
+        self.assertNotEqual(self.get('/api/recipes/')['ETag'], list_etag)
+
+    def test_missing_object(self):
+        response = self.client.get('/api/recipes/0/')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+
+class RecipeFragmentOverlayTest(RecipeTestData):
+    """
+    Общие фрагменты списка рецептов с флагами текущего пользователя
+    совпадают с детальным ответом, кто бы ни заполнил кэш первым.
+    """
+
+    def setUp(self):
+        super().setUp()
+        Subscription.objects.create(
+            subscribers=self.reader, author=self.author
+        )
+        Favorite.objects.create(user=self.author, recipe=self.recipes[2])
+        self.users = {
+            'anonymous': {},
+            'reader': self.auth_headers(),
+            'author': self.auth_headers(self.author_token),
+        }
+
+    def assert_list_matches_detail(self, headers):
+        recipes = self.client.get(
+            '/api/recipes/', {'limit': self.recipes_count}, headers=headers
+        ).json()['results']
+        self.assertEqual(len(recipes), self.recipes_count)
+        for recipe in recipes:
+            detail = self.client.get(
+                f'/api/recipes/{recipe["id"]}/', headers=headers
+            ).json()
+            # В списке изображение среднего размера, в рецепте — большое.
+            self.assertEqual({**recipe, 'image': None},
+                             {**detail, 'image': None})
+        return recipes
+
+    def test_cache_filled_by_any_user(self):
+        for order in (('anonymous', 'reader', 'author'),
+                      ('reader', 'author', 'anonymous')):
+            caches[settings.REFERENCE_CACHE_ALIAS].clear()
+            for user in order:
+                with self.subTest(order=order, user=user):
+                    self.assert_list_matches_detail(self.users[user])
+
+    def test_flags(self):
+        # Фрагменты кэширует автор со своими флагами.
+        self.assert_list_matches_detail(self.users['author'])
+        flags = {
+            user: {
+                recipe['id']: (recipe['is_favorited'],
+                               recipe['is_in_shopping_cart'],
+                               recipe['author']['is_subscribed'])
+                for recipe in self.assert_list_matches_detail(headers)
+            }
+            for user, headers in self.users.items()
+        }
+        first, second, third = (recipe.pk for recipe in self.recipes[:3])
+        self.assertEqual(flags['reader'][first], (True, False, False))
+        self.assertEqual(flags['reader'][second], (False, True, True))
+        self.assertEqual(flags['author'][third], (True, False, False))
+        self.assertFalse(any(
+            any(recipe_flags) for recipe_flags in flags['anonymous'].values()
+        ))
+
+    def test_recipe_change(self):
+        self.assert_list_matches_detail(self.users['reader'])
+        recipe = self.recipes[1]
+        recipe.name = 'Новое название'
+        recipe.save()
+        for user, headers in self.users.items():
+            with self.subTest(user=user):
+                names = {
+                    item['id']: item['name']
+                    for item in self.assert_list_matches_detail(headers)
+                }
+                self.assertEqual(names[recipe.pk], 'Новое название')
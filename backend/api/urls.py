@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from . import async_views
+from .views import (IngredientViewSet, RecipeViewSet, TagViewSet,
+                    UserViewSet, metrics)
 
 app_name = 'api'
 
@@ -13,4 +16,18 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics/', metrics, name='metrics'),
 ]
+
+if settings.ASYNC_VIEWS:
+    urlpatterns = [
+        path('tags/', async_views.tag_list, name='tags-list'),
+        path('tags/<int:pk>/', async_views.tag_detail, name='tags-detail'),
+        path('ingredients/', async_views.ingredient_list,
+             name='ingredients-list'),
+        path('ingredients/<int:pk>/', async_views.ingredient_detail,
+             name='ingredients-detail'),
+        path('recipes/', async_views.recipe_list, name='recipes-list'),
+        path('recipes/<int:pk>/', async_views.recipe_detail,
+             name='recipes-detail'),
+    ] + urlpatterns
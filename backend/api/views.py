@@ -1,38 +1,65 @@
-from django.db.models import Sum
-from django.http import HttpResponse, HttpResponseRedirect
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch, Value
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_safe
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
-from recipes.models import (AmountIngredientInRecipe, Cart, Favorite,
-                            Ingredient, Recipe, Tag)
-from rest_framework import filters, permissions, status, viewsets
+from recipes.models import Cart, Favorite, Ingredient, Recipe, Tag
+from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from users.models import Subscription, User
 
+from .cache import (ReferenceCacheMixin, VersionedResponseMixin,
+                    ingredients_cache, relation_cache, short_link_cache,
+                    tags_cache)
+from .constants import RECIPE_VERSION_FIELDS
 from .filters import IngredientSearchFilter, RecipeFilter
-from .pagination import CustomPageNumberPagination
+from .metrics import MetricsMixin, registry
+from .pagination import CustomPageNumberPagination, FeedPagination
+from .parsers import ImageUploadParser
 from .permissions import IsReadOnlyOrAuthor
-from .serializers import (AvatarSerializer, CartItemsSerializer,
-                          FavoriteItemsSerializer, FollowCreateSerializer,
-                          FollowSerializer, FollowTerminationValidator,
+from .serializers import (AvatarSerializer, BulkRecipeListSerializer,
+                          CartItemsSerializer, CookableQuerySerializer,
+                          CookableRecipeSerializer, FavoriteItemsSerializer,
+                          FollowCreateSerializer, FollowSerializer,
                           IngredientSerializer, RecipeDetailSerializer,
-                          RecipeEditorSerializer, TagSerializer,
-                          UserSerializer)
+                          RecipeEditorSerializer, RecipeImageSerializer,
+                          TagSerializer, UserSerializer)
+from .shopping_list import (SHOPPING_LIST_RENDERERS, ShoppingListNegotiation,
+                            get_shopping_list, iterate_async)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+IMAGE_PARSER_CLASSES = [JSONParser, MultiPartParser, ImageUploadParser]
+RELATION_MODELS = {'favorite': Favorite, 'shopping_cart': Cart}
+
+
+def image_upload_data(request, field_name):
+    """Данные запроса с изображением под именем поля сериализатора."""
+    upload = request.FILES.get('file')
+    if upload is not None and field_name not in request.data:
+        return {field_name: upload}
+    return request.data
+
+
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet для ингридиентов."""
 
+    reference_cache = ingredients_cache
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     filter_backends = [IngredientSearchFilter]
-    search_fields = ['^name']
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(MetricsMixin, VersionedResponseMixin,
+                    viewsets.ModelViewSet):
     """ViewSet для рецептов."""
 
     queryset = Recipe.objects.all()
@@ -41,9 +68,29 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permissions.IsAuthenticatedOrReadOnly,
         IsReadOnlyOrAuthor,
     ]
-    pagination_class = CustomPageNumberPagination
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    pagination_class = FeedPagination
+    filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    query_budget = {'list': 8, 'retrieve': 6, 'cookable': 6}
+    version_fields = RECIPE_VERSION_FIELDS
+    version_references = (tags_cache, ingredients_cache)
+
+    def get_serializer_context(self):
+        """В списке рецептов отдаются изображения среднего размера."""
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['image_size'] = 'medium'
+        return context
+
+    def get_queryset(self):
+        """
+        Рецепты с предзагрузкой. Флаги текущего пользователя
+        сериализатор берет из relation_cache. Для списка нужны
+        только версии: рецепты берутся из кэша фрагментов.
+        """
+        if self.action == 'list':
+            return Recipe.objects.only_versions()
+        return Recipe.objects.with_related()
 
     @action(
         detail=True,
@@ -58,8 +105,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """
         recipe = self.get_object()
         if not recipe.short_link:
-            recipe.short_link = recipe.generate_short_link()
-            recipe.save()
+            recipe.assign_short_link()
         short_link = f"{request.get_host()}/{recipe.short_link}/"
         return Response({'short-link': short_link}, status=status.HTTP_200_OK)
 
@@ -67,31 +113,146 @@ class RecipeViewSet(viewsets.ModelViewSet):
         detail=False,
         methods=['get'],
         permission_classes=[IsAuthenticated],
-        url_path='download_shopping_cart'
+        url_path='download_shopping_cart',
+        content_negotiation_class=ShoppingListNegotiation,
     )
     def download_shopping_cart(self, request):
-        """Скачивание списка покупок в виде текстового файла."""
-        ingredients = AmountIngredientInRecipe.objects.filter(
-            recipe__in=Cart.objects.filter(
-                user=request.user
-            ).values('recipe')
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(total=Sum('amount'))
-
-        text = 'Список покупок:\n\n'
-        for ing in ingredients:
-            text += (
-                f"{ing['ingredient__name']} "
-                f"({ing['ingredient__measurement_unit']}) - "
-                f"{ing['total']}\n"
+        """Потоковая выгрузка списка покупок в выбранном формате."""
+        export_format = request.query_params.get('format', 'txt')
+        renderer_class = SHOPPING_LIST_RENDERERS.get(export_format)
+        if renderer_class is None:
+            return Response(
+                {'errors': 'Доступные форматы: '
+                           f'{", ".join(SHOPPING_LIST_RENDERERS)}'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        response = HttpResponse(text, content_type='text/plain')
-        response[
-            'Content-Disposition'] = 'attachment; filename="shopping_list.txt"'
+        renderer = renderer_class()
+        content = renderer.render(get_shopping_list(request.user))
+        if isinstance(request._request, ASGIRequest):
+            content = iterate_async(content)
+        response = StreamingHttpResponse(
+            content, content_type=renderer.content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{renderer.filename}"'
+        )
         return response
 
+    @action(
+        detail=True,
+        methods=['put'],
+        permission_classes=[IsAuthenticated, IsReadOnlyOrAuthor],
+        parser_classes=IMAGE_PARSER_CLASSES,
+    )
+    def image(self, request, pk=None):
+        """
+        Замена изображения рецепта: base64 в JSON, multipart
+        или изображение телом запроса без кодирования.
+        """
+        recipe = self.get_object()
+        serializer = RecipeImageSerializer(
+            recipe,
+            data=image_upload_data(request, 'image'),
+            context=self.get_serializer_context(),
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(
+            RecipeDetailSerializer(
+                recipe, context=self.get_serializer_context()
+            ).data,
+            status=status.HTTP_200_OK
+        )
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[permissions.AllowAny],
+        pagination_class=CustomPageNumberPagination,
+    )
+    def cookable(self, request):
+        """
+        Рецепты из имеющихся ингредиентов: ?ingredients=1,2,3
+        и необязательный max_missing. Сначала рецепты, для которых
+        есть все ингредиенты, затем с одним недостающим и так далее.
+        """
+        data = {'ingredients': [
+            part
+            for value in request.query_params.getlist('ingredients')
+            for part in value.split(',') if part
+        ]}
+        if 'max_missing' in request.query_params:
+            data['max_missing'] = request.query_params['max_missing']
+        params = CookableQuerySerializer(data=data)
+        params.is_valid(raise_exception=True)
+        ingredient_ids = params.validated_data['ingredients']
+        queryset = self.filter_queryset(self.get_queryset()).cookable(
+            ingredient_ids, params.validated_data['max_missing']
+        )
+        context = self.get_serializer_context()
+        context['image_size'] = 'medium'
+        context['available_ingredients'] = set(ingredient_ids)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
+
+    def get_bulk_recipe_ids(self, request):
+        """Проверенный список id рецептов из тела запроса."""
+        serializer = BulkRecipeListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[IsAuthenticated],
+        url_path='(?P<action_type>favorite|shopping_cart)'
+    )
+    def bulk_add_to_list(self, request, action_type=None):
+        """
+        Добавление нескольких рецептов в избранное или список покупок.
+        Для каждого рецепта возвращается результат: added,
+        already_in_list или not_found.
+        """
+        recipe_ids = self.get_bulk_recipe_ids(request)
+        found = set(Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('pk', flat=True))
+        relation_model = RELATION_MODELS[action_type]
+        added = set(relation_model.objects.add_many(
+            request.user, [pk for pk in recipe_ids if pk in found]
+        ))
+        relation_cache.invalidate(relation_model, request.user.pk)
+        return Response({'results': [
+            {
+                'id': pk,
+                'status': (
+                    'added' if pk in added
+                    else 'already_in_list' if pk in found
+                    else 'not_found'
+                ),
+            }
+            for pk in recipe_ids
+        ]}, status=status.HTTP_200_OK)
+
+    @bulk_add_to_list.mapping.delete
+    def bulk_remove_from_list(self, request, action_type=None):
+        """
+        Удаление нескольких рецептов из избранного или списка покупок.
+        Для каждого рецепта возвращается результат: removed
+        или not_in_list.
+        """
+        recipe_ids = self.get_bulk_recipe_ids(request)
+        relation_model = RELATION_MODELS[action_type]
+        removed = set(relation_model.objects.remove_many(
+            request.user, recipe_ids
+        ))
+        relation_cache.invalidate(relation_model, request.user.pk)
+        return Response({'results': [
+            {'id': pk, 'status': 'removed' if pk in removed else 'not_in_list'}
+            for pk in recipe_ids
+        ]}, status=status.HTTP_200_OK)
+
     @action(
         detail=True,
         methods=['post'],
@@ -110,24 +271,26 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 {'errors': 'Неверный тип действия'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        serializer = serializer_class(
-            data={'recipe': recipe.id},
-            context={'request': request}
-        )
+        serializer = serializer_class(data={}, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        serializer.save(recipe=recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def get_serializer_class(self):
         """Выбор сериализатора в зависимости от действия."""
         if self.action in ("create", "update", "partial_update"):
             return RecipeEditorSerializer
+        if self.action == 'cookable':
+            return CookableRecipeSerializer
         return RecipeDetailSerializer
 
     @add_to_list.mapping.delete
     def remove_from_list(self, request, pk=None, action_type=None):
-        """Удаление рецепта из избранного или списка покупок."""
-        recipe = get_object_or_404(Recipe, id=pk)
+        """
+        Удаление рецепта из избранного или списка покупок.
+        Рецепт ищется только если удалять было нечего,
+        чтобы отличить 404 от 400.
+        """
         if action_type == 'shopping_cart':
             relation_model = Cart
         elif action_type == 'favorite':
@@ -138,42 +301,74 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         deleted_count, _ = relation_model.objects.filter(
-            user=request.user, recipe=recipe
+            user=request.user, recipe_id=pk
         ).delete()
         if not deleted_count:
+            get_object_or_404(Recipe, id=pk)
             return Response(
                 {'errors': 'Рецепт не найден в списке'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(
-        detail=False,
-        methods=['get'],
-        permission_classes=[AllowAny],
-        url_path='short-link-redirect'
+
+@require_safe
+def metrics(request):
+    """
+    Метрики процесса в формате Prometheus.
+    Доступны только с заголовком Authorization: Bearer METRICS_TOKEN.
+    """
+    expected = f'Bearer {settings.METRICS_TOKEN}'
+    if not settings.METRICS_TOKEN or not constant_time_compare(
+        request.headers.get('Authorization', ''), expected
+    ):
+        raise Http404
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
     )
-    def redirect_short_link(self, request, short_link=None):
-        """Перенаправление по короткой ссылке."""
 
-        recipe = get_object_or_404(Recipe, short_link=short_link)
-        return HttpResponseRedirect(f'/recipes/{recipe.pk}/')
 
+@require_safe
+def redirect_short_link(request, short_link):
+    """Перенаправление по короткой ссылке в обход стека DRF."""
+    pk = short_link_cache.resolve(short_link)
+    if pk is None:
+        raise Http404
+    return HttpResponseRedirect(f'/recipes/{pk}/')
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet для тегов."""
 
+    reference_cache = tags_cache
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(MetricsMixin, VersionedResponseMixin, DjoserUserViewSet):
     """ViewSet для пользователей."""
 
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = CustomPageNumberPagination
+    cursor_ordering = ('id',)
+    query_budget = {
+        'list': 5, 'retrieve': 4, 'me': 3, 'subscriptions': 4,
+    }
+
+    def get_version_queryset(self):
+        """Для me ответ зависит только от текущего пользователя."""
+        if self.action == 'me':
+            return User.objects.filter(pk=self.request.user.pk)
+        return super().get_version_queryset()
+
+    def get_serializer_class(self):
+        """Подписки отдаются с рецептами автора."""
+        if self.action in ('subscribe', 'subscriptions'):
+            return FollowSerializer
+        return super().get_serializer_class()
 
     @action(
         detail=True,
@@ -182,48 +377,74 @@ class UserViewSet(DjoserUserViewSet):
         url_path='subscribe'
     )
     def subscribe(self, request, id=None):
-        """Подписка на пользователя."""
-        author = get_object_or_404(User, id=id)
+        """
+        Подписка на пользователя. Автор загружается сразу
+        с данными для ответа.
+        """
+        author = get_object_or_404(
+            self.with_subscription_data(User.objects.all()), id=id
+        )
         serializer = FollowCreateSerializer(
             data=request.data,
             context={'request': request, 'author': author}
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        response_serializer = FollowSerializer(
-            author, context={'request': request}
-        )
+        response_serializer = self.get_serializer(author)
         return Response(response_serializer.data,
                         status=status.HTTP_201_CREATED)
 
+    def with_subscription_data(self, queryset):
+        """
+        Авторы с последними рецептами, выбранными одним
+        запросом с оконной функцией. Число рецептов хранится
+        в счетчике пользователя.
+        """
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time',
+            'author_id'
+        )
+        limit = self.request.query_params.get('recipes_limit')
+        if limit and limit.isdigit():
+            recipes = recipes[:int(limit)]
+        return queryset.annotate(
+            is_subscribed=Value(True),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        ).order_by('id')
+
     @action(
         detail=False,
         methods=['get'],
         permission_classes=[IsAuthenticated],
-        pagination_class=CustomPageNumberPagination
+        pagination_class=FeedPagination
     )
     def subscriptions(self, request):
         """Получение списка подписок пользователя."""
         user = request.user
-        queryset = User.objects.filter(subscribers__subscribers=user)
-        pages = self.paginate_queryset(queryset)
-        serializer = FollowSerializer(
-            pages, many=True, context={"request": request}
+        queryset = self.with_subscription_data(
+            User.objects.filter(subscribers__subscribers=user)
         )
+        pages = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(pages, many=True)
         return self.get_paginated_response(serializer.data)
 
     @action(
         detail=False,
         methods=['put'],
         permission_classes=[IsAuthenticated],
-        url_path='me/avatar'
+        url_path='me/avatar',
+        parser_classes=IMAGE_PARSER_CLASSES,
     )
     def avatar(self, request):
-        """Обновление аватара пользователя."""
+        """
+        Обновление аватара пользователя: base64 в JSON,
+        multipart или изображение телом запроса.
+        """
         user = request.user
         serializer = AvatarSerializer(
             user,
-            data=request.data,
+            data=image_upload_data(request, 'avatar'),
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
@@ -231,14 +452,18 @@ class UserViewSet(DjoserUserViewSet):
 
     @subscribe.mapping.delete
     def unsubscribe(self, request, id=None):
-        """Отписка от пользователя."""
-        author = get_object_or_404(User, id=id)
-        serializer = FollowTerminationValidator(
-            data={}, context={'request': request, 'author': author}
-        )
-        serializer.is_valid(raise_exception=True)
-        Subscription.objects.filter(
-            subscribers=request.user, author=author).delete()
+        """
+        Отписка от пользователя. Автор ищется только
+        если подписки не было, чтобы отличить 404 от 400.
+        """
+        deleted_count, _ = Subscription.objects.filter(
+            subscribers=request.user, author_id=id).delete()
+        if not deleted_count:
+            get_object_or_404(User, id=id)
+            return Response(
+                {'errors': 'Подписка не найдена'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @avatar.mapping.delete
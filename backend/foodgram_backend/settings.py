@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -94,6 +95,22 @@ DATABASES = {
     }
 }
 
+# Версии кэшей меняют все процессы, включая команды manage.py,
+# поэтому в production кэш общий: Redis по адресу CACHE_LOCATION.
+# Без него (разработка, тесты) кэш хранится в памяти процесса,
+# такую конфигурацию отклоняет manage.py check --deploy (api.E001).
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', '')
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.redis.RedisCache' if CACHE_LOCATION
+            else 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': CACHE_LOCATION,
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -174,3 +191,46 @@ CSRF_TRUSTED_ORIGINS = [
 
 CSRF_COOKIE_SECURE = True
 SESSION_COOKIE_SECURE = True
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT', '/usr/share/fonts/dejavu/DejaVuSans.ttf'
+)
+
+INGREDIENT_SEARCH_INDEX_TTL = int(
+    os.getenv('INGREDIENT_SEARCH_INDEX_TTL', 300)
+)
+INGREDIENT_SEARCH_INDEX_MAX_SIZE = int(
+    os.getenv('INGREDIENT_SEARCH_INDEX_MAX_SIZE', 50000)
+)
+# В PostgreSQL индекс в памяти отвечает только на запросы не длиннее
+# этого: по ним триграммный индекс не используется. Более длинные
+# запросы выполняет search_ingredients() по индексу pg_trgm.
+INGREDIENT_SEARCH_INDEX_MAX_TERM = int(
+    os.getenv('INGREDIENT_SEARCH_INDEX_MAX_TERM', 2)
+)
+
+REFERENCE_CACHE_ALIAS = 'default'
+REFERENCE_CACHE_TIMEOUT = int(os.getenv('REFERENCE_CACHE_TIMEOUT', 86400))
+REFERENCE_CACHE_LOCAL_SIZE = int(os.getenv('REFERENCE_CACHE_LOCAL_SIZE', 256))
+
+SHORT_LINK_SECRET = os.getenv('SHORT_LINK_SECRET', 'foodgram-short-links')
+SHORT_LINK_CACHE_TIMEOUT = int(os.getenv('SHORT_LINK_CACHE_TIMEOUT', 86400))
+SHORT_LINK_CACHE_LOCAL_SIZE = int(
+    os.getenv('SHORT_LINK_CACHE_LOCAL_SIZE', 10000)
+)
+RELATION_CACHE_TIMEOUT = int(os.getenv('RELATION_CACHE_TIMEOUT', 86400))
+RECIPE_FRAGMENT_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_FRAGMENT_CACHE_TIMEOUT', 3600)
+)
+PUBLIC_CACHE_MAX_AGE = int(os.getenv('PUBLIC_CACHE_MAX_AGE', 60))
+PAGINATION_EXACT_COUNT_THRESHOLD = int(
+    os.getenv('PAGINATION_EXACT_COUNT_THRESHOLD', 10000)
+)
+
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() == 'true'
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+QUERY_BUDGET_MODE = os.getenv('QUERY_BUDGET_MODE', 'log')
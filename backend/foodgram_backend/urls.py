@@ -20,14 +20,15 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
-from api.views import RecipeViewSet
+from api import async_views, views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
     path('<str:short_link>/',
-         RecipeViewSet.as_view(
-             {'get': 'redirect_short_link'}), name="redirect_short_link"),
+         async_views.redirect_short_link if settings.ASYNC_VIEWS
+         else views.redirect_short_link,
+         name="redirect_short_link"),
 ]
 
 if settings.DEBUG:
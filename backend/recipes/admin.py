@@ -7,6 +7,7 @@ from .models import (
     Favorite,
     Ingredient,
     Recipe,
+    ShoppingCartIngredient,
     Tag,
 )
 
@@ -35,18 +36,22 @@ class IngredientAdmin(admin.ModelAdmin):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     inlines = [AmountIngredientInRecipeInline]
-    list_display = ('name', 'author', 'favorites_count')
+    list_display = ('name', 'author', 'favorites_count', 'carts_count')
     search_fields = ('name', 'author__username')
     list_filter = ('tags',)
 
-    def favorites_count(self, obj):
-        return obj.in_favorites.count()
-
     def save_model(self, request, obj, form, change):
         if not obj.image:
             raise ValidationError("Нельзя загрузить без изображения.")
         super().save_model(request, obj, form, change)
 
+    def save_related(self, request, form, formsets, change):
+        with ShoppingCartIngredient.objects.track_recipe(form.instance):
+            super().save_related(request, form, formsets, change)
+        Recipe.objects.filter(
+            pk=form.instance.pk
+        ).update_ingredients_count()
+
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
@@ -0,0 +1,136 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from api.constants import IMAGE_SIZES
+
+logger = logging.getLogger(__name__)
+
+# Варианты строятся только в WebP. URL изображения входит в ответы,
+# которые кэшируют nginx, кэш фрагментов и ETag, поэтому формат
+# нельзя выбирать по заголовку Accept, и AVIF никогда бы не отдавался.
+IMAGE_FORMATS = tuple(
+    image_format for image_format in ('webp',)
+    if features.check(image_format)
+)
+
+_executor = None
+
+
+def get_executor():
+    """Пул потоков обработки изображений, создается при первом вызове."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix='images',
+        )
+    return _executor
+
+
+def needs_processing(field_file, variants):
+    """Проверяет, построены ли варианты для текущего файла."""
+    return bool(field_file) and variants.get('source') != field_file.name
+
+
+def build_variants(field_file):
+    """
+    Строит уменьшенные копии изображения во всех форматах.
+    Метаданные не переносятся, ориентация применяется к пикселям.
+    Возвращает {'source': имя, размер: {формат: имя файла}}.
+    """
+    storage = field_file.storage
+    root = os.path.splitext(field_file.name)[0]
+    with storage.open(field_file.name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    variants = {'source': field_file.name}
+    for size, max_side in IMAGE_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side))
+        variants[size] = {}
+        for image_format in IMAGE_FORMATS:
+            buffer = io.BytesIO()
+            resized.save(buffer, format=image_format.upper())
+            variants[size][image_format] = storage.save(
+                f'{root}__{size}.{image_format}',
+                ContentFile(buffer.getvalue())
+            )
+    return variants
+
+
+def delete_variants(storage, variants):
+    """Удаляет файлы устаревших вариантов."""
+    for size in IMAGE_SIZES:
+        for name in variants.get(size, {}).values():
+            storage.delete(name)
+
+
+def process_image(model, pk, field_name, variants_field):
+    """Обрабатывает изображение объекта и сохраняет варианты."""
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is None:
+            return
+        field_file = getattr(instance, field_name)
+        old_variants = getattr(instance, variants_field)
+        if not needs_processing(field_file, old_variants):
+            return
+        variants = build_variants(field_file)
+        # Варианты меняют URL изображений в ответах API,
+        # поэтому вместе с ними сдвигается версия объекта.
+        updated = model.objects.filter(
+            pk=pk, **{field_name: field_file.name}
+        ).update(**{variants_field: variants, 'updated_at': timezone.now()})
+        delete_variants(
+            field_file.storage, variants if not updated else old_variants
+        )
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s %s',
+                         model.__name__, pk)
+
+
+def _process_in_worker(*args):
+    """Обработка в потоке пула со своим соединением с базой."""
+    close_old_connections()
+    try:
+        process_image(*args)
+    finally:
+        close_old_connections()
+
+
+def schedule_processing(instance, field_name, variants_field):
+    """
+    Ставит обработку изображения в очередь после фиксации
+    транзакции. При IMAGE_PROCESSING_WORKERS = 0 обработка
+    выполняется сразу в текущем потоке.
+    """
+    args = (type(instance), instance.pk, field_name, variants_field)
+    if settings.IMAGE_PROCESSING_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(_process_in_worker, *args)
+        )
+    else:
+        transaction.on_commit(lambda: process_image(*args))
+
+
+def image_url(request, field_file, variants, size):
+    """URL варианта нужного размера или оригинала, если его еще нет."""
+    if not field_file:
+        return ""
+    url = field_file.url
+    if variants.get('source') == field_file.name:
+        names = variants.get(size, {})
+        name = next(
+            (names[fmt] for fmt in IMAGE_FORMATS if fmt in names), None
+        )
+        if name:
+            url = field_file.storage.url(name)
+    return request.build_absolute_uri(url) if request else url
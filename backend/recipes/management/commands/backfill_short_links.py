@@ -0,0 +1,43 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.short_links import encode, random_link
+
+
+class Command(BaseCommand):
+    help = 'Присваивает короткие ссылки рецептам, у которых их нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество рецептов в одном обновлении',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pks = Recipe.objects.filter(
+            short_link__isnull=True
+        ).values_list('pk', flat=True).iterator(chunk_size=batch_size)
+        assigned = 0
+        while batch := list(islice(pks, batch_size)):
+            links = {pk: encode(pk) for pk in batch}
+            taken = set(Recipe.objects.filter(
+                short_link__in=links.values()
+            ).values_list('short_link', flat=True))
+            for pk, link in links.items():
+                while link in taken:
+                    link = random_link()
+                    links[pk] = link
+                taken.add(link)
+            Recipe.objects.bulk_update(
+                [Recipe(pk=pk, short_link=link) for pk, link in links.items()],
+                ['short_link'],
+            )
+            assigned += len(batch)
+        self.stdout.write(
+            self.style.SUCCESS(f'Присвоено коротких ссылок: {assigned}.')
+        )
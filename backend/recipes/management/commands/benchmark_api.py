@@ -0,0 +1,398 @@
+import base64
+import io
+import json
+import math
+import statistics
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from api.urls import router
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+Step = namedtuple('Step', 'label method path data')
+
+# Эндпоинты djoser для управления учетной записью меняют пароль,
+# логин или отправляют письма, поэтому в замеры не входят.
+SKIPPED_URL_NAMES = {
+    'users-activation', 'users-resend-activation',
+    'users-reset-password', 'users-reset-password-confirm',
+    'users-reset-username', 'users-reset-username-confirm',
+    'users-set-password', 'users-set-username',
+}
+
+
+def image_data():
+    """Небольшое изображение в base64 для эндпоинтов записи."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), '#2a9d8f').save(buffer, 'PNG')
+    return (
+        'data:image/png;base64,'
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку и число SQL-запросов эндпоинтов API '
+        'на текущей базе и сравнивает результат с эталоном'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Количество замеров каждого запроса',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=2,
+            help='Количество прогревочных запросов без замера',
+        )
+        parser.add_argument(
+            '--user',
+            help='Email пользователя; по умолчанию самый активный',
+        )
+        parser.add_argument(
+            '--anonymous', action='store_true',
+            help='Запросы без токена, только чтение',
+        )
+        parser.add_argument(
+            '--writes', action='store_true',
+            help='Замерять и эндпоинты записи; данные возвращаются '
+                 'в исходное состояние',
+        )
+        parser.add_argument(
+            '--output', help='Сохранить результаты в JSON-файл',
+        )
+        parser.add_argument(
+            '--baseline', help='JSON-файл с эталонными результатами',
+        )
+        parser.add_argument(
+            '--max-regression', type=float, default=25,
+            help='Допустимый рост p95 относительно эталона, процентов',
+        )
+
+    def get_user(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'Пользователь не найден: {email}')
+            return user
+        user = User.objects.annotate(
+            carts=Count('in_carts')
+        ).order_by('-carts', 'pk').first()
+        if user is None:
+            raise CommandError(
+                'В базе нет пользователей, запустите '
+                'generate_synthetic_data'
+            )
+        return user
+
+    def get_read_steps(self, user):
+        recipe = Recipe.objects.exclude(short_link=None).first()
+        if recipe is None:
+            raise CommandError('В базе нет рецептов')
+        tag = Tag.objects.first()
+        ingredient = Ingredient.objects.first()
+        author = User.objects.order_by('-recipes_count', 'pk').first()
+        steps = [
+            Step('корень API', 'get', '/api/', None),
+            Step('пользователи', 'get', '/api/users/', None),
+            Step('пользователь', 'get', f'/api/users/{author.pk}/', None),
+            Step('теги', 'get', '/api/tags/', None),
+            Step('тег', 'get', f'/api/tags/{tag.pk}/', None),
+            Step('ингредиенты', 'get', '/api/ingredients/', None),
+            Step(
+                'поиск ингредиентов', 'get',
+                f'/api/ingredients/?name={ingredient.name[:3]}', None,
+            ),
+            Step(
+                'ингредиент', 'get',
+                f'/api/ingredients/{ingredient.pk}/', None,
+            ),
+            Step('рецепты', 'get', '/api/recipes/', None),
+            Step('рецепты, стр. 2', 'get', '/api/recipes/?page=2', None),
+            Step(
+                'рецепты, курсор', 'get', '/api/recipes/?cursor=', None,
+            ),
+            Step(
+                'рецепты, оценка числа', 'get',
+                '/api/recipes/?count=approximate', None,
+            ),
+            Step(
+                'рецепты по тегу', 'get',
+                f'/api/recipes/?tags={tag.slug}', None,
+            ),
+            Step(
+                'рецепты автора', 'get',
+                f'/api/recipes/?author={author.pk}', None,
+            ),
+            Step(
+                'рецепты из ингредиентов', 'get',
+                '/api/recipes/cookable/?max_missing=2&ingredients='
+                + ','.join(map(str, recipe.ingredient_amounts())), None,
+            ),
+            Step('рецепт', 'get', f'/api/recipes/{recipe.pk}/', None),
+            Step(
+                'короткая ссылка', 'get',
+                f'/api/recipes/{recipe.pk}/get-link/', None,
+            ),
+            Step('переход по ссылке', 'get', f'/{recipe.short_link}/', None),
+        ]
+        if user is None:
+            return steps
+        steps += [
+            Step('текущий пользователь', 'get', '/api/users/me/', None),
+            Step(
+                'подписки', 'get',
+                '/api/users/subscriptions/?recipes_limit=3', None,
+            ),
+            Step(
+                'избранное', 'get', '/api/recipes/?is_favorited=1', None,
+            ),
+            Step(
+                'рецепты в корзине', 'get',
+                '/api/recipes/?is_in_shopping_cart=1', None,
+            ),
+        ]
+        steps += [
+            Step(
+                f'список покупок, {export_format}', 'get',
+                '/api/recipes/download_shopping_cart/'
+                f'?format={export_format}',
+                None,
+            )
+            for export_format in ('txt', 'csv', 'json', 'pdf')
+        ]
+        return steps
+
+    def get_write_steps(self, user):
+        """Пары действий, которые возвращают данные в исходное состояние."""
+        recipe = Recipe.objects.exclude(author=user).exclude(
+            in_favorites__user=user
+        ).exclude(in_carts__user=user).first()
+        author = User.objects.exclude(pk=user.pk).exclude(
+            subscribers__subscribers=user
+        ).first()
+        ingredient = Ingredient.objects.first()
+        tag = Tag.objects.first()
+        image = image_data()
+        recipe_data = {
+            'name': 'Рецепт для замера',
+            'text': 'Создан командой benchmark_api.',
+            'cooking_time': 10,
+            'tags': [tag.pk],
+            'ingredients': [{'id': ingredient.pk, 'amount': 100}],
+            'image': image,
+        }
+        steps = []
+        if recipe is not None:
+            for action, added, removed in (
+                ('favorite', 'в избранное', 'из избранного'),
+                ('shopping_cart', 'в корзину', 'из корзины'),
+            ):
+                path = f'/api/recipes/{recipe.pk}/{action}/'
+                steps += [
+                    Step(f'добавление {added}', 'post', path, None),
+                    Step(f'удаление {removed}', 'delete', path, None),
+                ]
+        bulk_ids = list(Recipe.objects.exclude(author=user).exclude(
+            in_favorites__user=user
+        ).exclude(in_carts__user=user).values_list('pk', flat=True)[:10])
+        if bulk_ids:
+            for action, added, removed in (
+                ('favorite', 'в избранное', 'из избранного'),
+                ('shopping_cart', 'в корзину', 'из корзины'),
+            ):
+                path = f'/api/recipes/{action}/'
+                data = {'recipes': bulk_ids}
+                steps += [
+                    Step(f'пакетное добавление {added}', 'post', path, data),
+                    Step(f'пакетное удаление {removed}', 'delete', path,
+                         data),
+                ]
+        if author is not None:
+            path = f'/api/users/{author.pk}/subscribe/'
+            steps += [
+                Step('подписка', 'post', path, None),
+                Step('отписка', 'delete', path, None),
+            ]
+        if not user.avatar:
+            steps += [
+                Step('аватар', 'put', '/api/users/me/avatar/',
+                     {'avatar': image}),
+                Step('удаление аватара', 'delete', '/api/users/me/avatar/',
+                     None),
+            ]
+        steps += [
+            Step('создание рецепта', 'post', '/api/recipes/', recipe_data),
+            Step(
+                'изменение рецепта', 'patch',
+                lambda context: f'/api/recipes/{context["recipe"]}/',
+                dict(recipe_data, image=None, cooking_time=15),
+            ),
+            Step(
+                'изображение рецепта', 'put',
+                lambda context: f'/api/recipes/{context["recipe"]}/image/',
+                {'image': image},
+            ),
+            Step(
+                'удаление рецепта', 'delete',
+                lambda context: f'/api/recipes/{context["recipe"]}/',
+                None,
+            ),
+        ]
+        return steps
+
+    def request(self, client, step, context):
+        """Выполняет запрос и возвращает статус, время и число запросов."""
+        path = step.path(context) if callable(step.path) else step.path
+        data = step.data
+        if isinstance(data, dict):
+            data = {
+                key: value for key, value in data.items()
+                if value is not None
+            }
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.generic(
+                step.method.upper(),
+                path,
+                json.dumps(data) if data is not None else '',
+                content_type='application/json',
+            )
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - started) * 1000
+        if step.method == 'post' and path == '/api/recipes/':
+            context['recipe'] = response.json().get('id')
+        return path, response.status_code, elapsed, len(queries)
+
+    @staticmethod
+    def percentile(values, share):
+        return values[math.ceil(len(values) * share) - 1]
+
+    def run(self, client, steps, options):
+        results = {}
+        context = {}
+        for iteration in range(options['warmup'] + options['repeat']):
+            for step in steps:
+                path, status, elapsed, queries = self.request(
+                    client, step, context
+                )
+                if iteration < options['warmup']:
+                    continue
+                result = results.setdefault(step.label, {
+                    'method': step.method.upper(),
+                    'path': path,
+                    'url_name': resolve(path.split('?')[0]).url_name,
+                    'status': status,
+                    'queries': queries,
+                    'timings': [],
+                })
+                result['status'] = max(result['status'], status)
+                result['queries'] = max(result['queries'], queries)
+                result['timings'].append(elapsed)
+        for result in results.values():
+            timings = sorted(result.pop('timings'))
+            result['p50'] = round(statistics.median(timings), 2)
+            for share in (95, 99):
+                result[f'p{share}'] = round(
+                    self.percentile(timings, share / 100), 2
+                )
+        return results
+
+    def report(self, results):
+        for label, result in results.items():
+            style = (
+                self.style.ERROR if result['status'] >= 400
+                else self.style.SUCCESS
+            )
+            self.stdout.write(style(
+                f'{label} [{result["method"]} {result["path"]}] '
+                f'{result["status"]}: p50 {result["p50"]:.2f} мс, '
+                f'p95 {result["p95"]:.2f} мс, p99 {result["p99"]:.2f} мс, '
+                f'запросов {result["queries"]}'
+            ))
+        covered = {result['url_name'] for result in results.values()}
+        missing = sorted(
+            {url.name for url in router.urls}
+            - covered - SKIPPED_URL_NAMES
+        )
+        if missing:
+            self.stdout.write(self.style.WARNING(
+                f'Без замеров: {", ".join(missing)}'
+            ))
+
+    def compare(self, results, baseline_path, max_regression):
+        """Список регрессий относительно эталона."""
+        with open(baseline_path, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+        regressions = []
+        for label, result in results.items():
+            reference = baseline.get(label)
+            if reference is None:
+                continue
+            if result['queries'] > reference['queries']:
+                regressions.append(
+                    f'{label}: запросов {reference["queries"]} '
+                    f'-> {result["queries"]}'
+                )
+            limit = reference['p95'] * (1 + max_regression / 100)
+            if result['p95'] > limit:
+                regressions.append(
+                    f'{label}: p95 {reference["p95"]:.2f} '
+                    f'-> {result["p95"]:.2f} мс'
+                )
+        return regressions
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должно быть больше нуля')
+        host = next(
+            (host.lstrip('.') for host in settings.ALLOWED_HOSTS
+             if host != '*'),
+            'localhost',
+        )
+        user = None
+        client = Client(HTTP_HOST=host)
+        if not options['anonymous']:
+            user = self.get_user(options['user'])
+            token, _ = Token.objects.get_or_create(user=user)
+            client = Client(
+                HTTP_HOST=host, HTTP_AUTHORIZATION=f'Token {token.key}'
+            )
+        steps = self.get_read_steps(user)
+        if options['writes'] and user is not None:
+            steps += self.get_write_steps(user)
+        self.stdout.write(
+            f'СУБД: {connection.vendor}, '
+            f'рецептов: {Recipe.objects.count()}, '
+            f'пользователь: {user.email if user else "аноним"}'
+        )
+        results = self.run(client, steps, options)
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(
+                    {'vendor': connection.vendor, 'results': results},
+                    file, ensure_ascii=False, indent=2,
+                )
+        if options['baseline']:
+            regressions = self.compare(
+                results, options['baseline'], options['max_regression']
+            )
+            if regressions:
+                for line in regressions:
+                    self.stdout.write(self.style.ERROR(line))
+                raise CommandError(f'Регрессий: {len(regressions)}')
+            self.stdout.write(self.style.SUCCESS('Регрессий нет.'))
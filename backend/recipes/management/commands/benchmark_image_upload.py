@@ -0,0 +1,156 @@
+import base64
+import io
+import json
+import math
+import os
+import tempfile
+import tracemalloc
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe
+from users.models import User
+
+MEGABYTE = 1024 * 1024
+
+
+def png_image(size):
+    """PNG из случайных пикселей: почти не сжимается, весит около size."""
+    side = max(1, math.isqrt(size // 3))
+    image = Image.frombytes(
+        'RGB', (side, side), os.urandom(side * side * 3)
+    )
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', compress_level=0)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет пик памяти Python (tracemalloc) при загрузке '
+        'изображения рецепта через PUT /api/recipes/{id}/image/: '
+        'base64 в JSON, multipart и изображение телом запроса'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1, 10],
+            help='Размеры изображений в мегабайтах',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=1,
+            help='Количество замеров каждого способа загрузки',
+        )
+        parser.add_argument(
+            '--user',
+            help='Email автора рецепта; по умолчанию первый пользователь',
+        )
+
+    def get_user(self, email):
+        users = User.objects.order_by('pk')
+        if email:
+            users = users.filter(email=email)
+        user = users.first()
+        if user is None:
+            raise CommandError(
+                f'Пользователь не найден: {email}' if email else
+                'В базе нет пользователей, запустите '
+                'generate_synthetic_data'
+            )
+        return user
+
+    @staticmethod
+    def requests(content):
+        """Способ загрузки и аргументы Client.generic для него."""
+        return [
+            ('base64', {
+                'data': json.dumps({'image': (
+                    'data:image/png;base64,'
+                    + base64.b64encode(content).decode()
+                )}),
+                'content_type': 'application/json',
+            }),
+            ('multipart', {
+                'data': encode_multipart(BOUNDARY, {
+                    'image': SimpleUploadedFile(
+                        'image.png', content, 'image/png'
+                    ),
+                }),
+                'content_type': MULTIPART_CONTENT,
+            }),
+            ('тело запроса', {
+                'data': content,
+                'content_type': 'image/png',
+            }),
+        ]
+
+    def upload(self, client, path, kwargs):
+        """Пик памяти за время запроса и статус ответа."""
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            response = client.generic('PUT', path, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return response.status_code, peak
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должно быть больше нуля')
+        if min(options['sizes']) < 1:
+            raise CommandError('--sizes должны быть больше нуля')
+        # Рецепт и токен откатываются вместе с транзакцией, а файлы
+        # изображений пишутся во временный MEDIA_ROOT и удаляются.
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root), \
+                transaction.atomic():
+            self.benchmark(options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, options):
+        user = self.get_user(options['user'])
+        token, _ = Token.objects.get_or_create(user=user)
+        host = next(
+            (host.lstrip('.') for host in settings.ALLOWED_HOSTS
+             if host != '*'),
+            'localhost',
+        )
+        client = Client(
+            HTTP_HOST=host, HTTP_AUTHORIZATION=f'Token {token.key}'
+        )
+        recipe = Recipe.objects.create(
+            author=user,
+            name='Рецепт для замера',
+            text='Создан командой benchmark_image_upload.',
+            cooking_time=10,
+        )
+        path = f'/api/recipes/{recipe.pk}/image/'
+        # Прогрев: первые запросы загружают модули и кэши.
+        for _, kwargs in self.requests(png_image(1024)):
+            client.generic('PUT', path, **kwargs)
+        for size in options['sizes']:
+            content = png_image(size * MEGABYTE)
+            for method, kwargs in self.requests(content):
+                peaks = []
+                for _ in range(options['repeat']):
+                    status, peak = self.upload(client, path, kwargs)
+                    peaks.append(peak)
+                body = len(kwargs['data'])
+                style = (
+                    self.style.ERROR if status >= 400
+                    else self.style.SUCCESS
+                )
+                self.stdout.write(style(
+                    f'{size} МБ, {method}: статус {status}, '
+                    f'тело {body / MEGABYTE:.1f} МБ, '
+                    f'пик {max(peaks) / MEGABYTE:.1f} МБ '
+                    f'({max(peaks) / body:.2f} тела)'
+                ))
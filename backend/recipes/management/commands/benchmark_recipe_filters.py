@@ -0,0 +1,93 @@
+import math
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+
+from api.constants import PAGINATION_PAGE_COUNT
+from api.filters import RecipeFilter
+from recipes.models import Cart, Favorite, Recipe, Tag
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Показывает планы и задержку запросов фильтра рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Количество повторов каждого запроса',
+        )
+        parser.add_argument(
+            '--no-explain',
+            action='store_true',
+            help='Не выводить планы запросов',
+        )
+
+    def get_cases(self):
+        """Наборы параметров фильтра для замеров."""
+        slugs = list(Tag.objects.values_list('slug', flat=True)[:3])
+        favorite = Favorite.objects.values_list('user', flat=True).first()
+        cart = Cart.objects.values_list('user', flat=True).first()
+        author = Recipe.objects.values_list('author', flat=True).first()
+        cases = [('без фильтров', {}, None)]
+        if slugs:
+            cases.append(('один тег', {'tags': slugs[:1]}, None))
+            cases.append(('несколько тегов', {'tags': slugs}, None))
+        if author:
+            cases.append(('автор', {'author': [author]}, None))
+        if favorite:
+            cases.append(('избранное', {'is_favorited': ['1']}, favorite))
+        if cart:
+            cases.append(
+                ('корзина', {'is_in_shopping_cart': ['1']}, cart)
+            )
+        if favorite and slugs:
+            cases.append((
+                'избранное и теги',
+                {'is_favorited': ['1'], 'tags': slugs},
+                favorite,
+            ))
+        return cases
+
+    def build_queryset(self, params, user_id):
+        request = RequestFactory().get('/api/recipes/')
+        request.user = AnonymousUser()
+        if user_id is not None:
+            request.user = User.objects.get(pk=user_id)
+        data = request.GET.copy()
+        for key, values in params.items():
+            data.setlist(key, [str(value) for value in values])
+        return RecipeFilter(
+            data, queryset=Recipe.objects.all(), request=request
+        ).qs[:PAGINATION_PAGE_COUNT]
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должно быть больше нуля')
+        self.stdout.write(
+            f'Рецептов: {Recipe.objects.count()}, '
+            f'СУБД: {connection.vendor}'
+        )
+        for title, params, user_id in self.get_cases():
+            queryset = self.build_queryset(params, user_id)
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[math.ceil(len(timings) * 0.95) - 1]
+            self.stdout.write(self.style.SUCCESS(
+                f'{title}: p50 {statistics.median(timings):.2f} мс, '
+                f'p95 {p95:.2f} мс'
+            ))
+            if not options['no_explain']:
+                analyze = connection.vendor == 'postgresql'
+                self.stdout.write(queryset.explain(analyze=analyze)
+                                  if analyze else queryset.explain())
@@ -0,0 +1,220 @@
+import io
+import random
+import time
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from PIL import Image
+
+from recipes.models import (AmountIngredientInRecipe, Cart, Favorite,
+                            Ingredient, Recipe, RecipeTag,
+                            ShoppingCartIngredient, Tag)
+from users.models import Subscription, User
+
+EMAIL_DOMAIN = 'synthetic.foodgram'
+TAG_NAMES = (
+    'Завтрак', 'Обед', 'Ужин', 'Десерт', 'Выпечка', 'Салаты',
+    'Супы', 'Напитки', 'Закуски', 'Вегетарианское',
+)
+DISH_WORDS = (
+    'Суп', 'Салат', 'Пирог', 'Рагу', 'Запеканка', 'Омлет',
+    'Каша', 'Паста', 'Плов', 'Котлеты', 'Блины', 'Смузи',
+)
+DISH_DETAILS = (
+    'по-домашнему', 'с травами', 'быстрый', 'праздничный',
+    'острый', 'бабушкин', 'летний', 'сытный', 'легкий',
+)
+IMAGE_COLORS = (
+    '#e76f51', '#f4a261', '#e9c46a', '#2a9d8f', '#264653',
+    '#8ab17d', '#b5838d', '#6d597a',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает синтетические данные для нагрузочных тестов: '
+        'пользователей, подписки, рецепты, избранное и корзины. '
+        'При одинаковом --seed данные совпадают.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Количество пользователей')
+        parser.add_argument('--recipes', type=int, default=5000,
+                            help='Количество рецептов')
+        parser.add_argument('--tags', type=int, default=len(TAG_NAMES),
+                            help='Количество тегов')
+        parser.add_argument('--ingredients-per-recipe', type=int,
+                            default=8,
+                            help='Максимум ингредиентов в рецепте')
+        parser.add_argument('--subscriptions', type=int, default=20,
+                            help='Максимум подписок пользователя')
+        parser.add_argument('--favorites', type=int, default=30,
+                            help='Максимум рецептов в избранном')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Максимум рецептов в корзине')
+        parser.add_argument('--password', default='password',
+                            help='Пароль всех пользователей')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Начальное значение генератора')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Количество строк в одной вставке')
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить ранее созданные данные')
+
+    def insert(self, model, objects):
+        """Вставляет объекты пачками, не собирая их все в памяти."""
+        objects = iter(objects)
+        total = 0
+        while batch := list(islice(objects, self.batch_size)):
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+            total += len(batch)
+        self.stdout.write(f'{model.__name__}: {total}')
+        return total
+
+    def sample(self, population, limit, exclude=None):
+        """Случайная выборка размером от нуля до limit."""
+        size = self.random.randint(0, min(limit, len(population)))
+        chosen = self.random.sample(population, size)
+        return [item for item in chosen if item != exclude]
+
+    def create_images(self):
+        """Несколько изображений-заглушек, общих для всех рецептов."""
+        names = []
+        for index, color in enumerate(IMAGE_COLORS):
+            name = f'recipes/synthetic_{index}.png'
+            if not default_storage.exists(name):
+                buffer = io.BytesIO()
+                Image.new('RGB', (600, 400), color).save(buffer, 'PNG')
+                name = default_storage.save(
+                    name, ContentFile(buffer.getvalue())
+                )
+            names.append(name)
+        return names
+
+    def create_tags(self, count):
+        names = list(TAG_NAMES[:count]) + [
+            f'Тег {index}' for index in range(len(TAG_NAMES), count)
+        ]
+        return [Tag.objects.get_or_create(name=name)[0].pk for name in names]
+
+    def create_users(self, count, password):
+        hashed = make_password(password)
+        self.insert(User, (
+            User(
+                username=f'synthetic{index}',
+                email=f'user{index}@{EMAIL_DOMAIN}',
+                first_name=f'Имя{index}',
+                last_name=f'Фамилия{index}',
+                password=hashed,
+            )
+            for index in range(count)
+        ))
+        return list(User.objects.filter(
+            email__endswith=f'@{EMAIL_DOMAIN}'
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def create_recipes(self, count, user_ids, images):
+        self.insert(Recipe, (
+            Recipe(
+                author_id=self.random.choice(user_ids),
+                name=(
+                    f'{self.random.choice(DISH_WORDS)} '
+                    f'{self.random.choice(DISH_DETAILS)} №{index}'
+                ),
+                text='Синтетический рецепт для нагрузочного теста.',
+                cooking_time=self.random.randint(5, 180),
+                image=self.random.choice(images),
+            )
+            for index in range(count)
+        ))
+        return list(Recipe.objects.filter(
+            author_id__in=user_ids
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def clear(self):
+        """Удаляет синтетических пользователей вместе с их данными."""
+        deleted, _ = User.objects.filter(
+            email__endswith=f'@{EMAIL_DOMAIN}'
+        ).delete()
+        self.stdout.write(f'Удалено объектов: {deleted}')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        if self.batch_size < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        if min(options['users'], options['tags']) < 1:
+            raise CommandError('Нужен хотя бы один пользователь и тег')
+        if options['clear']:
+            self.clear()
+        if User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').exists():
+            raise CommandError(
+                'Синтетические данные уже созданы, используйте --clear'
+            )
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients')
+        started = time.monotonic()
+        ingredient_ids = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        if not ingredient_ids:
+            raise CommandError('Нет ингредиентов для рецептов')
+        tag_ids = self.create_tags(options['tags'])
+        user_ids = self.create_users(options['users'], options['password'])
+        recipe_ids = self.create_recipes(
+            options['recipes'], user_ids, self.create_images()
+        )
+        self.insert(AmountIngredientInRecipe, (
+            AmountIngredientInRecipe(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=self.random.randint(1, 500),
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in self.random.sample(
+                ingredient_ids,
+                self.random.randint(
+                    1, min(options['ingredients_per_recipe'],
+                           len(ingredient_ids))
+                ),
+            )
+        ))
+        self.insert(RecipeTag, (
+            RecipeTag(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.random.sample(
+                tag_ids, self.random.randint(1, min(3, len(tag_ids)))
+            )
+        ))
+        self.insert(Subscription, (
+            Subscription(subscribers_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in self.sample(
+                user_ids, options['subscriptions'], exclude=user_id
+            )
+        ))
+        for model, limit in ((Favorite, options['favorites']),
+                             (Cart, options['carts'])):
+            self.insert(model, (
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in self.sample(recipe_ids, limit)
+            ))
+        if connection.vendor == 'postgresql':
+            Recipe.objects.filter(
+                pk__in=recipe_ids
+            ).update_search_vectors()
+        ShoppingCartIngredient.objects.rebuild(
+            user_ids, batch_size=self.batch_size
+        )
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('backfill_short_links', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные созданы за {time.monotonic() - started:.1f} с.'
+        ))
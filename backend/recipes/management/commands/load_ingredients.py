@@ -1,39 +1,111 @@
 import csv
 import os
+import time
+from itertools import islice
 
+import ijson
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
+from api.cache import ingredients_cache
 from recipes.models import Ingredient
 
+CSV_HEADER = ['name', 'measurement_unit']
+
 
 class Command(BaseCommand):
-    help = 'Загружает ингредиенты из CSV-файла'
+    help = 'Загружает ингредиенты из CSV- или JSON-файла пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default=os.path.join(settings.BASE_DIR,
+                                 'fixtures/ingredients_with_headers.csv'),
+            help='Путь к файлу с ингредиентами',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            help='Формат файла; по умолчанию определяется по расширению',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одной вставке',
+        )
 
-    def handle(self, *args, **kwargs):
-        file_path = os.path.join(settings.BASE_DIR,
-                                 'fixtures/ingredients_with_headers.csv')
+    def skip(self, place, row):
+        """Сообщает о пропущенной неполной строке."""
+        self.stderr.write(self.style.WARNING(
+            f'{place}: нет названия или единицы измерения, '
+            f'строка пропущена: {row!r}'
+        ))
 
+    def read_csv(self, file_path):
+        """Построчно читает CSV с заголовком или без него."""
+        with open(file_path, newline='', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            for row in reader:
+                if not row or row == CSV_HEADER:
+                    continue
+                if len(row) < len(CSV_HEADER):
+                    self.skip(f'Строка {reader.line_num}', row)
+                    continue
+                yield row[0], row[1]
+
+    def read_json(self, file_path):
+        """
+        Читает JSON-массив объектов с полями name и measurement_unit
+        потоком, не загружая весь файл в память.
+        """
+        with open(file_path, 'rb') as file:
+            for number, item in enumerate(ijson.items(file, 'item'), 1):
+                try:
+                    yield item['name'], item['measurement_unit']
+                except (KeyError, TypeError):
+                    self.skip(f'Элемент {number}', item)
+
+    def handle(self, *args, **options):
+        file_path = options['file']
         if not os.path.exists(file_path):
             self.stdout.write(self.style.ERROR(f'Файл не найден: {file_path}'))
             return
+        file_format = options['format'] or (
+            'json' if file_path.endswith('.json') else 'csv'
+        )
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть положительным')
 
-        with open(file_path, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            added = 0
-            skipped = 0
-            for row in reader:
-                name = row['name']
-                unit = row['measurement_unit']
-                obj, created = Ingredient.objects.get_or_create(
-                    name=name, measurement_unit=unit
+        started = time.monotonic()
+        count_before = Ingredient.objects.count()
+        processed = 0
+        reader = getattr(self, f'read_{file_format}')(file_path)
+        try:
+            while batch := list(islice(reader, batch_size)):
+                Ingredient.objects.bulk_create(
+                    [
+                        Ingredient(
+                            name=name.strip(),
+                            measurement_unit=unit.strip()
+                        )
+                        for name, unit in batch
+                    ],
+                    ignore_conflicts=True,
                 )
-                if created:
-                    added += 1
-                else:
-                    skipped += 1
+                processed += len(batch)
+        except ijson.JSONError as error:
+            raise CommandError(f'Некорректный JSON: {error}')
+        added = Ingredient.objects.count() - count_before
+        ingredients_cache.invalidate()
+
+        elapsed = time.monotonic() - started
         self.stdout.write(
             self.style.SUCCESS(
-                f'Загрузка закончена: добавлено {added}, пропущено {skipped}.'
+                f'Загрузка закончена: добавлено {added}, '
+                f'пропущено {processed - added}, '
+                f'{processed / max(elapsed, 1e-6):.0f} строк/с '
+                f'за {elapsed:.2f} с.'
             )
         )
@@ -0,0 +1,152 @@
+import http.client
+import math
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Ingredient, Recipe, Tag
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест читающих эндпоинтов по HTTP. '
+        'Несколько --url сравниваются на одинаковой нагрузке, '
+        'например WSGI и ASGI развертывания.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            action='append',
+            required=True,
+            help='Адрес сервера, можно с меткой: asgi=http://host:8000',
+        )
+        parser.add_argument(
+            '--path',
+            action='append',
+            help='Путь запроса; по умолчанию набор из данных в базе',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=32,
+            help='Количество одновременных клиентов',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=30,
+            help='Длительность замера для каждого сервера, секунд',
+        )
+        parser.add_argument(
+            '--token',
+            help='Токен пользователя для заголовка Authorization',
+        )
+
+    def get_paths(self):
+        """Типичные запросы на чтение по данным из базы."""
+        paths = ['/api/recipes/', '/api/recipes/?page=2', '/api/tags/']
+        tag = Tag.objects.values_list('slug', flat=True).first()
+        if tag:
+            paths.append(f'/api/recipes/?tags={tag}')
+        for pk, short_link in Recipe.objects.values_list(
+            'pk', 'short_link'
+        )[:5]:
+            paths.append(f'/api/recipes/{pk}/')
+            if short_link:
+                paths.append(f'/{short_link}/')
+        name = Ingredient.objects.values_list('name', flat=True).first()
+        if name:
+            paths.append(f'/api/ingredients/?name={quote(name[:3])}')
+        return paths
+
+    def run(self, url, paths, options):
+        """Гоняет запросы по кругу и собирает задержки по путям."""
+        parts = urlsplit(url)
+        connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        deadline = time.monotonic() + options['duration']
+        lock = threading.Lock()
+        timings = {path: [] for path in paths}
+        errors = {path: 0 for path in paths}
+
+        def client(offset):
+            connection = connection_class(parts.netloc, timeout=30)
+            position = offset
+            while time.monotonic() < deadline:
+                path = paths[position % len(paths)]
+                position += 1
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    failed = response.status >= 400
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    failed = True
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    if failed:
+                        errors[path] += 1
+                    else:
+                        timings[path].append(elapsed)
+            connection.close()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(client, range(options['concurrency'])))
+        return timings, errors, time.monotonic() - started
+
+    @staticmethod
+    def percentile(values, share):
+        return values[math.ceil(len(values) * share) - 1]
+
+    def report(self, label, timings, errors, elapsed):
+        total = sum(len(values) for values in timings.values())
+        failed = sum(errors.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: {total / elapsed:.1f} запросов/с, '
+            f'успешных {total}, ошибок {failed}'
+        ))
+        for path, values in timings.items():
+            if not values:
+                self.stdout.write(f'  {path}: нет успешных ответов')
+                continue
+            values.sort()
+            self.stdout.write(
+                f'  {path}: p50 {statistics.median(values):.1f} мс, '
+                f'p95 {self.percentile(values, 0.95):.1f} мс, '
+                f'p99 {self.percentile(values, 0.99):.1f} мс, '
+                f'ошибок {errors[path]}'
+            )
+        return total / elapsed
+
+    def handle(self, *args, **options):
+        paths = options['path'] or self.get_paths()
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency должно быть больше нуля')
+        results = []
+        for url in options['url']:
+            label, _, address = url.rpartition('=')
+            label = label or address
+            timings, errors, elapsed = self.run(address, paths, options)
+            results.append(
+                (label, self.report(label, timings, errors, elapsed))
+            )
+        if len(results) > 1:
+            base_label, base = results[0]
+            for label, throughput in results[1:]:
+                self.stdout.write(
+                    f'{label} / {base_label}: '
+                    f'{throughput / base if base else 0:.2f}x'
+                )
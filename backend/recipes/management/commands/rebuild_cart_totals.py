@@ -0,0 +1,59 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Проверяет и пересобирает суммы ингредиентов в корзинах'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только найти расхождения, ничего не меняя',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пачки при вставке',
+        )
+
+    def find_drift(self):
+        """Возвращает id пользователей с расхождениями в суммах."""
+        expected = defaultdict(dict)
+        for user_id, ingredient_id, total in (
+            ShoppingCartIngredient.objects.expected().iterator()
+        ):
+            expected[user_id][ingredient_id] = total
+        stored = defaultdict(dict)
+        for user_id, ingredient_id, amount in (
+            ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        ):
+            stored[user_id][ingredient_id] = amount
+        return sorted(
+            user_id for user_id in expected.keys() | stored.keys()
+            if expected.get(user_id) != stored.get(user_id)
+        )
+
+    def handle(self, *args, **options):
+        drifted = self.find_drift()
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
+            return
+        self.stdout.write(self.style.WARNING(
+            f'Расхождения у пользователей ({len(drifted)}): '
+            f'{", ".join(map(str, drifted))}'
+        ))
+        if options['check']:
+            return
+        ShoppingCartIngredient.objects.rebuild(
+            drifted, batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано корзин: {len(drifted)}.'
+        ))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import AmountIngredientInRecipe, Cart, Favorite, Recipe
+from users.models import User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'carts_count', Cart, 'recipe'),
+    (Recipe, 'ingredients_count', AmountIngredientInRecipe, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Проверяет и исправляет денормализованные счетчики'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только найти расхождения, ничего не меняя',
+        )
+
+    @staticmethod
+    def actual_count(related_model, field_name):
+        """Подзапрос с фактическим числом связанных строк."""
+        return Coalesce(Subquery(
+            related_model.objects.filter(
+                **{field_name: OuterRef('pk')}
+            ).order_by().values(field_name).annotate(
+                total=Count('pk')
+            ).values('total')
+        ), 0)
+
+    def handle(self, *args, **options):
+        drifted_total = 0
+        for model, counter, related_model, field_name in COUNTERS:
+            actual = self.actual_count(related_model, field_name)
+            drifted = model.objects.annotate(actual=actual).exclude(
+                **{counter: F('actual')}
+            )
+            count = drifted.count()
+            drifted_total += count
+            label = f'{model.__name__}.{counter}'
+            if not count:
+                self.stdout.write(f'{label}: расхождений нет.')
+                continue
+            self.stdout.write(self.style.WARNING(
+                f'{label}: расхождений {count}.'
+            ))
+            if not options['check']:
+                model.objects.filter(
+                    pk__in=drifted.values('pk')
+                ).update(**{counter: actual})
+        if drifted_total and not options['check']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Исправлено счетчиков: {drifted_total}.'
+            ))
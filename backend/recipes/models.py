@@ -1,24 +1,49 @@
-from random import choices
+from contextlib import contextmanager
+from itertools import islice
 
 import unidecode
 from api.constants import (MAX_LENGTH_INGREDIENT_NAME,
                            MAX_LENGTH_MEASUREMENT_UNIT, MAX_LENGTH_RECIPE_NAME,
                            MAX_LENGTH_SHORT_LINK, MAX_LENGTH_TAG_NAME,
                            MAX_LENGTH_TAG_SLUG, MIN_COOKING_TIME,
-                           MIN_INGREDIENT_AMOUNT, ALLOWED_CHARS)
+                           MIN_INGREDIENT_AMOUNT, RECIPE_SEARCH_CONFIG,
+                           SHORT_LINK_ATTEMPTS)
 from autoslug import AutoSlugField
 from django.conf import settings
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import (Aggregate, Count, F, OuterRef, Prefetch,
+                              Subquery, Sum, Value)
+from django.db.models.functions import Coalesce
 from users.models import User
 
+from . import short_links
+
 
 def transliterate_slugify(value):
     """Транслитерирует кириллицу в латиницу перед slugify."""
     return unidecode.unidecode(value)
 
 
+def change_counter(model, pk, field, delta):
+    """
+    Атомарно изменяет счетчик объекта выражением F().
+    Счетчик не опускается ниже нуля, расхождения исправляет
+    команда reconcile_counters.
+    """
+    return change_counters(model, [pk], field, delta)
+
+
+def change_counters(model, pks, field, delta):
+    """Изменяет счетчик сразу у нескольких объектов одним UPDATE."""
+    queryset = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
 class Ingredient(models.Model):
     "Модель для ингридиентов."
     name = models.CharField(
@@ -64,6 +89,86 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Запросы рецептов с предзагрузкой связанных данных."""
+
+    def with_related(self):
+        """Подгружает автора, теги и ингредиенты без N+1 запросов."""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipes_with_ingredient',
+                queryset=AmountIngredientInRecipe.objects.select_related(
+                    'ingredient'
+                ),
+            ),
+        )
+
+    def only_versions(self):
+        """
+        Только id, порядок и версии рецепта и автора: общая часть
+        представления берется из кэша фрагментов.
+        """
+        return self.select_related('author').only(
+            'id', 'created_at', 'updated_at', 'author__updated_at'
+        )
+
+    def update_search_vectors(self):
+        """
+        Пересчитывает поисковые векторы одним UPDATE (только
+        PostgreSQL): название с весом A, ингредиенты — B, текст — C.
+        """
+        ingredient_names = AmountIngredientInRecipe.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(names=Aggregate(
+            'ingredient__name', Value(' '),
+            function='STRING_AGG',
+            output_field=models.TextField(),
+        )).values('names')
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=RECIPE_SEARCH_CONFIG)
+            + SearchVector(
+                Coalesce(
+                    Subquery(ingredient_names), Value(''),
+                    output_field=models.TextField(),
+                ),
+                weight='B',
+                config=RECIPE_SEARCH_CONFIG,
+            )
+            + SearchVector('text', weight='C', config=RECIPE_SEARCH_CONFIG)
+        ))
+
+    def update_ingredients_count(self):
+        """Пересчитывает число ингредиентов рецептов одним UPDATE."""
+        return self.update(ingredients_count=Coalesce(Subquery(
+            AmountIngredientInRecipe.objects.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                total=Count('pk')
+            ).values('total')
+        ), 0))
+
+    def cookable(self, ingredient_ids, max_missing=0):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов
+        ingredient_ids и недостает не больше max_missing остальных.
+        Строки состава выбираются по индексу (ingredient, recipe),
+        а недостающие считаются по ingredients_count без полного
+        перебора составов. Сначала идут рецепты, для которых есть
+        все ингредиенты.
+        """
+        covered = Count('recipes_with_ingredient')
+        return self.filter(
+            recipes_with_ingredient__ingredient_id__in=ingredient_ids
+        ).annotate(
+            covered_ingredients=covered,
+            missing_ingredients=F('ingredients_count') - covered,
+        ).filter(
+            missing_ingredients__lte=max_missing
+        ).order_by('missing_ingredients', '-covered_ingredients',
+                   '-created_at', '-id')
+
+
 class Recipe(models.Model):
     name = models.CharField(max_length=MAX_LENGTH_RECIPE_NAME)
     text = models.TextField()
@@ -83,6 +188,7 @@ class Recipe(models.Model):
     )
     tags = models.ManyToManyField(Tag, related_name="recipes")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     short_link = models.CharField(
         max_length=MAX_LENGTH_SHORT_LINK,
@@ -90,24 +196,99 @@ class Recipe(models.Model):
         null=True,
         unique=True,
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False
+    )
+    carts_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False
+    )
+    ingredients_count = models.PositiveIntegerField(
+        'Ингредиентов', default=0, editable=False
+    )
+    search_vector = SearchVectorField(null=True, editable=False)
 
-    def generate_short_link(self):
+    objects = RecipeQuerySet.as_manager()
+
+    COUNTER_FIELDS = ('favorites_count', 'carts_count', 'ingredients_count')
+    SEARCH_FIELDS = ('name', 'text')
+
+    def save(self, *args, **kwargs):
+        """
+        Сохранение существующего рецепта не перезаписывает счетчики
+        и поисковый вектор: они меняются только через change_counter
+        и update_search_vectors.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+                and field.name != 'search_vector'
+            ]
+        super().save(*args, **kwargs)
+
+    def ingredient_amounts(self):
+        """Возвращает словарь {id ингредиента: количество}."""
+        return dict(
+            self.recipes_with_ingredient.values_list('ingredient_id', 'amount')
+        )
+
+    def generate_short_link(self, attempt=0):
         "Генерирует уникальный короткий ключ"
-        slug = ''.join(choices(ALLOWED_CHARS, k=MAX_LENGTH_SHORT_LINK))
-        if not Recipe.objects.filter(short_link=slug).exists():
-            return slug
+        if attempt:
+            return short_links.random_link()
+        return short_links.encode(self.pk)
+
+    def assign_short_link(self):
+        """
+        Сохраняет короткую ссылку, обновляя только это поле.
+        При коллизии со старой ссылкой пробует случайные.
+        """
+        for attempt in range(SHORT_LINK_ATTEMPTS):
+            self.short_link = self.generate_short_link(attempt)
+            try:
+                with transaction.atomic():
+                    self.save(update_fields=['short_link'])
+                return self.short_link
+            except IntegrityError:
+                continue
+        self.short_link = None
         raise ValidationError("""Не удалось сгенерировать
                                   уникальный короткий URL""")
 
     class Meta:
         """ """
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='recipe_created_at_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-created_at', '-id'],
+                name='recipe_author_created_at_idx'
+            ),
+            models.Index(
+                fields=['updated_at'],
+                name='recipe_updated_at_idx'
+            ),
+        ]
 
     def __str__(self):
         """ """
         return f"Рецепт: {self.name} (ID: {self.id})"  #
 
 
+# Промежуточная таблица тегов, которую создает Django. Индекс
+# (tag_id, recipe_id) для фильтра по тегам добавляет post_migrate.
+RecipeTag = Recipe.tags.through
+
+
 class AmountIngredientInRecipe(models.Model):
     """ """
 
@@ -137,11 +318,84 @@ class AmountIngredientInRecipe(models.Model):
 
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['ingredient', 'recipe'],
+                name='ingredient_recipe_idx'
+            )
+        ]
 
     def __str__(self):
         return f'{self.ingredient} — {self.amount} (для {self.recipe})'  #
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    """
+    Массовое добавление и удаление рецептов в списке пользователя.
+    id измененных строк возвращает сама база (RETURNING), поэтому
+    счетчики и суммы корзины меняются только для строк, которые
+    вставил или удалил этот запрос, даже если тот же рецепт
+    параллельно добавляют или удаляют поштучно.
+    """
+
+    def execute_returning(self, sql, params):
+        """Выполняет запрос и возвращает множество recipe_id."""
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return {row[0] for row in cursor.fetchall()}
+
+    def columns(self):
+        meta = self.model._meta
+        quote = connections[self.db].ops.quote_name
+        return (
+            quote(meta.db_table),
+            quote(meta.get_field('user').column),
+            quote(meta.get_field('recipe').column),
+        )
+
+    def add_many(self, user, recipe_ids):
+        """
+        Добавляет рецепты одним INSERT ... ON CONFLICT DO NOTHING
+        и возвращает id добавленных в порядке recipe_ids.
+        """
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        if not recipe_ids:
+            return []
+        table, user_column, recipe_column = self.columns()
+        values = ', '.join(['(%s, %s)'] * len(recipe_ids))
+        with transaction.atomic(using=self.db):
+            inserted = self.execute_returning(
+                f'INSERT INTO {table} ({user_column}, {recipe_column}) '
+                f'VALUES {values} ON CONFLICT DO NOTHING '
+                f'RETURNING {recipe_column}',
+                [value for pk in recipe_ids for value in (user.pk, pk)],
+            )
+            added = [pk for pk in recipe_ids if pk in inserted]
+            self.model.relations_changed(user.pk, added, 1)
+        return added
+
+    def remove_many(self, user, recipe_ids):
+        """
+        Удаляет рецепты одним DELETE ... RETURNING и возвращает
+        id удаленных в порядке recipe_ids.
+        """
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        if not recipe_ids:
+            return []
+        table, user_column, recipe_column = self.columns()
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with transaction.atomic(using=self.db):
+            deleted = self.execute_returning(
+                f'DELETE FROM {table} WHERE {user_column} = %s '
+                f'AND {recipe_column} IN ({placeholders}) '
+                f'RETURNING {recipe_column}',
+                [user.pk, *recipe_ids],
+            )
+            removed = [pk for pk in recipe_ids if pk in deleted]
+            self.model.relations_changed(user.pk, removed, -1)
+        return removed
+
+
 class BaseChoiceModel(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -160,17 +414,188 @@ class BaseChoiceModel(models.Model):
                 name='unique_user_recipe_%(class)s'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'],
+                name='%(class)s_recipe_user_idx'
+            )
+        ]
         default_related_name = 'in_%(class)ss'
         ordering = ['recipe__name']
 
+    objects = UserRecipeQuerySet.as_manager()
+
+    # Счетчик рецепта, который отражает число строк модели.
+    recipe_counter = None
+
+    @classmethod
+    def relations_changed(cls, user_id, recipe_ids, sign):
+        """Обновляет счетчики после массового изменения списка."""
+        if recipe_ids:
+            change_counters(Recipe, recipe_ids, cls.recipe_counter, sign)
+
 
 class Favorite(BaseChoiceModel):
+    recipe_counter = 'favorites_count'
+
     class Meta(BaseChoiceModel.Meta):
         verbose_name = 'Favourite'
         verbose_name_plural = 'Favourites'
 
 
 class Cart(BaseChoiceModel):
+    recipe_counter = 'carts_count'
+
     class Meta(BaseChoiceModel.Meta):
         verbose_name = 'Cart'
         verbose_name_plural = 'Carts'
+
+    @classmethod
+    def relations_changed(cls, user_id, recipe_ids, sign):
+        """Вместе со счетчиками пересчитывает суммы корзины."""
+        super().relations_changed(user_id, recipe_ids, sign)
+        ShoppingCartIngredient.objects.add_recipes(
+            user_id, recipe_ids, sign
+        )
+
+
+class ShoppingCartIngredientQuerySet(models.QuerySet):
+    """Запросы к суммарным количествам ингредиентов в корзинах."""
+
+    def apply_delta(self, user_ids, amounts, batch_size=1000):
+        """
+        Прибавляет к корзинам пользователей изменения количеств
+        ингредиентов вида {id ингредиента: прирост}. Строки
+        вставляются или увеличиваются одним INSERT ... ON CONFLICT
+        DO UPDATE, поэтому параллельные изменения одной корзины
+        не конфликтуют на уникальном индексе (user, ingredient).
+        Строки идут в порядке ключа, чтобы блокировки брались
+        в одном порядке и запросы не ждали друг друга по кругу.
+        """
+        amounts = {key: value for key, value in amounts.items() if value}
+        rows = sorted(
+            (user_id, ingredient_id, delta)
+            for user_id in set(user_ids)
+            for ingredient_id, delta in amounts.items()
+        )
+        if not rows:
+            return
+        meta = self.model._meta
+        quote = connections[self.db].ops.quote_name
+        table = quote(meta.db_table)
+        user_column = quote(meta.get_field('user').column)
+        ingredient_column = quote(meta.get_field('ingredient').column)
+        amount_column = quote(meta.get_field('amount').column)
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                for start in range(0, len(rows), batch_size):
+                    batch = rows[start:start + batch_size]
+                    values = ', '.join(['(%s, %s, %s)'] * len(batch))
+                    cursor.execute(
+                        f'INSERT INTO {table} ({user_column}, '
+                        f'{ingredient_column}, {amount_column}) '
+                        f'VALUES {values} '
+                        f'ON CONFLICT ({user_column}, {ingredient_column}) '
+                        f'DO UPDATE SET {amount_column} = '
+                        f'{table}.{amount_column} + EXCLUDED.{amount_column}',
+                        [value for row in batch for value in row],
+                    )
+            self.filter(
+                user_id__in={row[0] for row in rows}, amount__lte=0
+            ).delete()
+
+    def add_recipe(self, user_id, recipe_id, sign=1):
+        """Учитывает добавление (или удаление) рецепта в корзине."""
+        self.add_recipes(user_id, [recipe_id], sign)
+
+    def add_recipes(self, user_id, recipe_ids, sign=1):
+        """Учитывает добавление (или удаление) нескольких рецептов."""
+        if not recipe_ids:
+            return
+        amounts = AmountIngredientInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id').annotate(
+            total=Sum('amount')
+        ).order_by()
+        self.apply_delta(
+            [user_id],
+            {ingredient_id: sign * total for ingredient_id, total in amounts}
+        )
+
+    @contextmanager
+    def track_recipe(self, recipe):
+        """
+        Переносит в корзины изменения ингредиентов рецепта,
+        сделанные внутри блока with.
+        """
+        with transaction.atomic():
+            before = recipe.ingredient_amounts()
+            yield
+            after = recipe.ingredient_amounts()
+            self.apply_delta(
+                Cart.objects.filter(recipe=recipe).values_list(
+                    'user_id', flat=True
+                ),
+                {
+                    ingredient_id: (
+                        after.get(ingredient_id, 0)
+                        - before.get(ingredient_id, 0)
+                    )
+                    for ingredient_id in before.keys() | after.keys()
+                }
+            )
+
+    def expected(self, user_ids=None):
+        """Пересчитывает суммы по таблицам корзины и рецептов."""
+        # Одно условие на связь с корзиной: второй filter() по той же
+        # многозначной связи добавил бы еще один JOIN и умножил суммы.
+        lookups = {'recipe__in_carts__isnull': False}
+        if user_ids is not None:
+            lookups = {'recipe__in_carts__user__in': user_ids}
+        queryset = AmountIngredientInRecipe.objects.filter(**lookups)
+        return queryset.values_list(
+            'recipe__in_carts__user', 'ingredient'
+        ).annotate(total=Sum('amount')).order_by()
+
+    def rebuild(self, user_ids=None, batch_size=1000):
+        """Полностью пересобирает суммы для указанных пользователей."""
+        with transaction.atomic():
+            stale = self.all()
+            if user_ids is not None:
+                stale = stale.filter(user_id__in=user_ids)
+            stale.delete()
+            rows = self.expected(user_ids).iterator(chunk_size=batch_size)
+            while batch := list(islice(rows, batch_size)):
+                self.bulk_create([
+                    self.model(user_id=user_id, ingredient_id=ingredient_id,
+                               amount=total)
+                    for user_id, ingredient_id, total in batch
+                ])
+
+
+class ShoppingCartIngredient(models.Model):
+    """Суммарное количество ингредиента в корзине пользователя."""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    amount = models.IntegerField(default=0)
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_user_ingredient_in_cart'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} — {self.amount}'
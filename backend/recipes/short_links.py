@@ -0,0 +1,51 @@
+import hashlib
+from random import choices
+
+from django.conf import settings
+
+from api.constants import (ALLOWED_CHARS, MAX_LENGTH_SHORT_LINK,
+                           SHORT_LINK_FEISTEL_ROUNDS)
+
+# Размер блока в битах и длина ссылки: 36**6 > 2**30, 36**12 > 2**60.
+SHORT_LINK_DOMAINS = ((30, 6), (60, MAX_LENGTH_SHORT_LINK))
+
+
+def _feistel(value, bits, key):
+    """Перестановка чисел [0, 2**bits) сетью Фейстеля с ключом."""
+    half = bits // 2
+    mask = (1 << half) - 1
+    left, right = value >> half, value & mask
+    for round_number in range(SHORT_LINK_FEISTEL_ROUNDS):
+        digest = hashlib.blake2b(
+            f'{round_number}:{right}'.encode(), key=key, digest_size=8
+        ).digest()
+        left, right = right, left ^ (int.from_bytes(digest, 'big') & mask)
+    return (left << half) | right
+
+
+def _to_base36(value, length):
+    """Кодирует число строкой фиксированной длины."""
+    base = len(ALLOWED_CHARS)
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, base)
+        chars.append(ALLOWED_CHARS[remainder])
+    return ''.join(reversed(chars))
+
+
+def encode(pk):
+    """
+    Детерминированная короткая ссылка для первичного ключа.
+    Перестановка взаимно однозначна, поэтому у разных рецептов
+    ссылки не совпадают и проверять их в базе не нужно.
+    """
+    key = settings.SHORT_LINK_SECRET.encode()[:hashlib.blake2b.MAX_KEY_SIZE]
+    for bits, length in SHORT_LINK_DOMAINS:
+        if pk < 1 << bits:
+            return _to_base36(_feistel(pk, bits, key), length)
+    raise ValueError(f'Слишком большой идентификатор: {pk}')
+
+
+def random_link():
+    """Случайная ссылка на случай коллизии со старыми ссылками."""
+    return ''.join(choices(ALLOWED_CHARS, k=MAX_LENGTH_SHORT_LINK))
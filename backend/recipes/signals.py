@@ -0,0 +1,196 @@
+from django.db import connection, connections, transaction
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from users.models import User
+
+from .images import needs_processing, schedule_processing
+from .models import (AmountIngredientInRecipe, Cart, Favorite, Ingredient,
+                     Recipe, RecipeTag, ShoppingCartIngredient, change_counter,
+                     change_counters)
+
+INGREDIENT_TRIGRAM_INDEX_SQL = (
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+    'ON {table} USING gin (UPPER(name::text) gin_trgm_ops)'
+)
+RECIPE_SEARCH_INDEX_SQL = (
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_gin '
+    'ON {table} USING gin (search_vector)'
+)
+RECIPE_TAG_INDEX_SQL = (
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_tags_tag_recipe_idx '
+    'ON {table} (tag_id, recipe_id)'
+)
+
+
+@receiver(post_save, sender=Cart)
+def add_recipe_to_cart_totals(sender, instance, created, **kwargs):
+    """Добавляет ингредиенты рецепта к сумме корзины."""
+    if created:
+        ShoppingCartIngredient.objects.add_recipe(
+            instance.user_id, instance.recipe_id
+        )
+
+
+@receiver(pre_delete, sender=Cart)
+def remove_recipe_from_cart_totals(sender, instance, **kwargs):
+    """
+    Вычитает ингредиенты рецепта из суммы корзины.
+    Используется pre_delete: при каскадном удалении рецепта
+    его ингредиенты удаляются раньше, чем отправляется post_delete.
+    """
+    ShoppingCartIngredient.objects.add_recipe(
+        instance.user_id, instance.recipe_id, sign=-1
+    )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Cart)
+def increment_recipe_counter(sender, instance, created, **kwargs):
+    """Увеличивает счетчик избранного или корзин рецепта."""
+    if created:
+        change_counter(Recipe, instance.recipe_id, sender.recipe_counter, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Cart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    """Уменьшает счетчик избранного или корзин рецепта."""
+    change_counter(Recipe, instance.recipe_id, sender.recipe_counter, -1)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def decrement_recipes_ingredients_count(sender, instance, **kwargs):
+    """
+    Уменьшает число ингредиентов рецептов, из которых удаляется
+    ингредиент. Используется pre_delete: к post_delete строки
+    состава уже удалены каскадом.
+    """
+    change_counters(
+        Recipe,
+        AmountIngredientInRecipe.objects.filter(
+            ingredient=instance
+        ).values('recipe_id'),
+        'ingredients_count',
+        -1,
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def increment_author_recipes_count(sender, instance, created, **kwargs):
+    """Увеличивает счетчик рецептов автора."""
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_author_recipes_count(sender, instance, **kwargs):
+    """Уменьшает счетчик рецептов автора."""
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, created, update_fields=None,
+                                **kwargs):
+    """
+    Пересчитывает поисковый вектор после фиксации транзакции,
+    когда ингредиенты рецепта уже сохранены (только PostgreSQL).
+    """
+    if connection.vendor != 'postgresql':
+        return
+    if update_fields is not None and not set(update_fields) & set(
+        Recipe.SEARCH_FIELDS
+    ):
+        return
+    transaction.on_commit(
+        Recipe.objects.filter(pk=instance.pk).update_search_vectors
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search_vectors(sender, instance, created,
+                                             **kwargs):
+    """Название ингредиента входит в векторы его рецептов."""
+    if created or connection.vendor != 'postgresql':
+        return
+    Recipe.objects.filter(
+        recipes_with_ingredient__ingredient=instance
+    ).update_search_vectors()
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(sender, instance, **kwargs):
+    """Ставит в очередь обработку нового изображения рецепта."""
+    if needs_processing(instance.image, instance.image_variants):
+        schedule_processing(instance, 'image', 'image_variants')
+
+
+@receiver(post_save, sender=User)
+def process_user_avatar(sender, instance, update_fields=None, **kwargs):
+    """Ставит в очередь обработку нового аватара."""
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    if needs_processing(instance.avatar, instance.avatar_variants):
+        schedule_processing(instance, 'avatar', 'avatar_variants')
+
+
+@receiver(post_migrate)
+def create_ingredient_search_index(sender, using, **kwargs):
+    """
+    Создает триграммный индекс для поиска ингредиентов
+    по префиксу и подстроке (только PostgreSQL).
+    Выражение индекса совпадает с тем, что Django строит
+    для name__icontains и name__istartswith.
+    """
+    connection = connections[using]
+    table = Ingredient._meta.db_table
+    if (sender.name != 'recipes'
+            or connection.vendor != 'postgresql'
+            or table not in connection.introspection.table_names()):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute(INGREDIENT_TRIGRAM_INDEX_SQL.format(
+            table=connection.ops.quote_name(table)
+        ))
+
+
+@receiver(post_migrate)
+def create_recipe_tag_index(sender, using, **kwargs):
+    """
+    Создает индекс (tag_id, recipe_id) в таблице тегов рецептов
+    для фильтра по тегам. Уникальный индекс (recipe_id, tag_id)
+    Django создает сам, но начинается он с рецепта.
+    """
+    connection = connections[using]
+    table = RecipeTag._meta.db_table
+    if (sender.name != 'recipes'
+            or connection.vendor not in ('postgresql', 'sqlite')
+            or table not in connection.introspection.table_names()):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(RECIPE_TAG_INDEX_SQL.format(
+            table=connection.ops.quote_name(table)
+        ))
+
+
+@receiver(post_migrate)
+def create_recipe_search_index(sender, using, **kwargs):
+    """
+    Создает GIN-индекс полнотекстового поиска рецептов
+    и заполняет векторы, которых еще нет (только PostgreSQL).
+    """
+    connection = connections[using]
+    table = Recipe._meta.db_table
+    if (sender.name != 'recipes'
+            or connection.vendor != 'postgresql'
+            or table not in connection.introspection.table_names()):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(RECIPE_SEARCH_INDEX_SQL.format(
+            table=connection.ops.quote_name(table)
+        ))
+    Recipe.objects.using(using).filter(
+        search_vector=None
+    ).update_search_vectors()
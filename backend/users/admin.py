@@ -20,7 +20,10 @@ class RequiredFieldsUsersCreationForm(BaseUserCreationForm):
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
     add_form = RequiredFieldsUsersCreationForm
-    list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff')
+    list_display = (
+        'username', 'email', 'first_name', 'last_name', 'is_staff',
+        'recipes_count',
+    )
     search_fields = ("email", 'username')
     list_filter = ('is_superuser', 'is_staff')
     add_fieldsets = (
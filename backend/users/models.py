@@ -23,12 +23,35 @@ class User(AbstractUser):
         null=True,
         blank=True,
     )
+    avatar_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    COUNTER_FIELDS = ('recipes_count',)
 
     class Meta:
         ordering = ['id']
 
+    def save(self, *args, **kwargs):
+        """
+        Сохранение существующего пользователя не перезаписывает
+        счетчики: они меняются только через change_counter.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class Subscription(models.Model):
     author = models.ForeignKey(